@@ -73,14 +73,12 @@ class Bottleneck(nn.Module):
         return out
 
 class CEFPN(nn.Module):
-    def __init__(self, block, num_blocks,in_channel, device):
+    def __init__(self, block, num_blocks,in_channel, device=None):
         super(CEFPN, self).__init__()
 
         self.in_planes = 64
-        if device=='cpu':
-            self.conv1 = CoordConv2d(in_channel, 64, kernel_size=3, stride=1, padding=1, bias=False,use_cuda=False)
-        else:
-            self.conv1 = CoordConv2d(in_channel, 64, kernel_size=3, stride=1, padding=1, bias=False)
+        # device is unused (kept for old callers), the module is moved with .to()
+        self.conv1 = CoordConv2d(in_channel, 64, kernel_size=3, stride=1, padding=1, bias=False)
         self.bn1 = nn.BatchNorm2d(64)
 
         # Bottom-up layers
@@ -187,5 +185,5 @@ class CEFPN(nn.Module):
         r4 = self.smooth3(r4)
         r5 = self.Adpool(r5)
         return r2, r3, r4, r5
-def CEFPN101(in_channel,device):
+def CEFPN101(in_channel,device=None):
     return CEFPN(Bottleneck, [2,2,2,2],in_channel, device)
@@ -1,17 +1,105 @@
+import collections
 import torch
 import torch.nn as nn
 import torch.nn.modules.conv as conv
 
 
+def make_coord_channels(rank, dims):
+    """
+    coordinate channels of a (1, C, *dims) input, each of shape (1, 1, *dims)
+    """
+    if rank == 1:
+        dim_x, = dims
+        xx_range = torch.arange(dim_x, dtype=torch.int32)
+        xx_channel = xx_range[None, None, :]
+
+        xx_channel = xx_channel.float() / (dim_x - 1)
+        xx_channel = xx_channel * 2 - 1
+        return [xx_channel]
+
+    elif rank == 2:
+        dim_y, dim_x = dims
+        xx_ones = torch.ones([1, 1, 1, dim_x], dtype=torch.int32)
+        yy_ones = torch.ones([1, 1, 1, dim_y], dtype=torch.int32)
+
+        xx_range = torch.arange(dim_y, dtype=torch.int32)
+        yy_range = torch.arange(dim_x, dtype=torch.int32)
+        xx_range = xx_range[None, None, :, None]
+        yy_range = yy_range[None, None, :, None]
+
+        xx_channel = torch.matmul(xx_range, xx_ones)
+        yy_channel = torch.matmul(yy_range, yy_ones)
+
+        # transpose y
+        yy_channel = yy_channel.permute(0, 1, 3, 2)
+
+        xx_channel = xx_channel.float() / (dim_y - 1)
+        yy_channel = yy_channel.float() / (dim_x - 1)
+
+        xx_channel = xx_channel * 2 - 1
+        yy_channel = yy_channel * 2 - 1
+        return [xx_channel, yy_channel]
+
+    elif rank == 3:
+        dim_z, dim_y, dim_x = dims
+        xx_ones = torch.ones([1, 1, 1, 1, dim_x], dtype=torch.int32)
+        yy_ones = torch.ones([1, 1, 1, 1, dim_y], dtype=torch.int32)
+        zz_ones = torch.ones([1, 1, 1, 1, dim_z], dtype=torch.int32)
+
+        xy_range = torch.arange(dim_y, dtype=torch.int32)
+        xy_range = xy_range[None, None, None, :, None]
+
+        yz_range = torch.arange(dim_z, dtype=torch.int32)
+        yz_range = yz_range[None, None, None, :, None]
+
+        zx_range = torch.arange(dim_x, dtype=torch.int32)
+        zx_range = zx_range[None, None, None, :, None]
+
+        xy_channel = torch.matmul(xy_range, xx_ones)
+        xx_channel = torch.cat([xy_channel + i for i in range(dim_z)], dim=2)
+
+        yz_channel = torch.matmul(yz_range, yy_ones)
+        yz_channel = yz_channel.permute(0, 1, 3, 4, 2)
+        yy_channel = torch.cat([yz_channel + i for i in range(dim_x)], dim=4)
+
+        zx_channel = torch.matmul(zx_range, zz_ones)
+        zx_channel = zx_channel.permute(0, 1, 4, 2, 3)
+        zz_channel = torch.cat([zx_channel + i for i in range(dim_y)], dim=3)
+        return [xx_channel, yy_channel, zz_channel]
+    else:
+        raise NotImplementedError
+
+
 class AddCoords(nn.Module):
-    def __init__(self, rank, w=256,h=256,with_r=False, use_cuda=True,skiptile=False):
+    def __init__(self, rank, w=256,h=256,with_r=False, use_cuda=True,skiptile=False, cache_size=8):
         super(AddCoords, self).__init__()
         self.rank = rank
         self.with_r = with_r
-        self.use_cuda = use_cuda
+        self.use_cuda = use_cuda  # kept for existing callers; outputs follow the input device
         self.skiptile = skiptile
         self.w = w
         self.h = h
+        # coordinate channels (+ r) per (spatial shape, device), least recently used dropped first
+        self.cache_size = cache_size
+        self.coord_cache = collections.OrderedDict()
+
+    def coord_channels(self, dims, device):
+        key = (tuple(dims), str(device))
+        if key in self.coord_cache:
+            self.coord_cache.move_to_end(key)
+            return self.coord_cache[key]
+        channels = make_coord_channels(self.rank, dims)
+        if self.with_r:
+            if self.rank == 1:
+                rr = torch.sqrt(torch.pow(channels[0] - 0.5, 2))
+            else:
+                rr = torch.sqrt(sum(torch.pow(channel - 0.5, 2) for channel in channels))
+            channels.append(rr)
+        coords = torch.cat(channels, dim=1).to(device)
+        self.coord_cache[key] = coords
+        if len(self.coord_cache) > self.cache_size:
+            self.coord_cache.popitem(last=False)
+        return coords
 
     def forward(self, input_tensor):
         """
@@ -20,104 +108,11 @@ class AddCoords(nn.Module):
         """
         if not self.skiptile:
             input_tensor = torch.tile(input_tensor, [1, 1,self.h, self.w]) # (batch, 64, 64, 2)
-        if self.rank == 1:
-            batch_size_shape, channel_in_shape, dim_x = input_tensor.shape
-            xx_range = torch.arange(dim_x, dtype=torch.int32)
-            xx_channel = xx_range[None, None, :]
-
-            xx_channel = xx_channel.float() / (dim_x - 1)
-            xx_channel = xx_channel * 2 - 1
-            xx_channel = xx_channel.repeat(batch_size_shape, 1, 1)
-
-            if torch.cuda.is_available and self.use_cuda:
-                input_tensor = input_tensor.cuda()
-                xx_channel = xx_channel.cuda()
-            out = torch.cat([input_tensor, xx_channel], dim=1)
-
-            if self.with_r:
-                rr = torch.sqrt(torch.pow(xx_channel - 0.5, 2))
-                out = torch.cat([out, rr], dim=1)
-
-        elif self.rank == 2:
-            batch_size_shape, channel_in_shape, dim_y, dim_x = input_tensor.shape
-            xx_ones = torch.ones([1, 1, 1, dim_x], dtype=torch.int32)
-            yy_ones = torch.ones([1, 1, 1, dim_y], dtype=torch.int32)
-
-            xx_range = torch.arange(dim_y, dtype=torch.int32)
-            yy_range = torch.arange(dim_x, dtype=torch.int32)
-            xx_range = xx_range[None, None, :, None]
-            yy_range = yy_range[None, None, :, None]
-
-            xx_channel = torch.matmul(xx_range, xx_ones)
-            yy_channel = torch.matmul(yy_range, yy_ones)
-
-            # transpose y
-            yy_channel = yy_channel.permute(0, 1, 3, 2)
-
-            xx_channel = xx_channel.float() / (dim_y - 1)
-            yy_channel = yy_channel.float() / (dim_x - 1)
-
-            xx_channel = xx_channel * 2 - 1
-            yy_channel = yy_channel * 2 - 1
-
-            xx_channel = xx_channel.repeat(batch_size_shape, 1, 1, 1)
-            yy_channel = yy_channel.repeat(batch_size_shape, 1, 1, 1)
-
-            if torch.cuda.is_available and self.use_cuda:
-                input_tensor = input_tensor.cuda()
-                xx_channel = xx_channel.cuda()
-                yy_channel = yy_channel.cuda()
-            out = torch.cat([input_tensor, xx_channel, yy_channel], dim=1)
-
-            if self.with_r:
-                rr = torch.sqrt(torch.pow(xx_channel - 0.5, 2) + torch.pow(yy_channel - 0.5, 2))
-                out = torch.cat([out, rr], dim=1)
-
-        elif self.rank == 3:
-            batch_size_shape, channel_in_shape, dim_z, dim_y, dim_x = input_tensor.shape
-            xx_ones = torch.ones([1, 1, 1, 1, dim_x], dtype=torch.int32)
-            yy_ones = torch.ones([1, 1, 1, 1, dim_y], dtype=torch.int32)
-            zz_ones = torch.ones([1, 1, 1, 1, dim_z], dtype=torch.int32)
-
-            xy_range = torch.arange(dim_y, dtype=torch.int32)
-            xy_range = xy_range[None, None, None, :, None]
-
-            yz_range = torch.arange(dim_z, dtype=torch.int32)
-            yz_range = yz_range[None, None, None, :, None]
-
-            zx_range = torch.arange(dim_x, dtype=torch.int32)
-            zx_range = zx_range[None, None, None, :, None]
-
-            xy_channel = torch.matmul(xy_range, xx_ones)
-            xx_channel = torch.cat([xy_channel + i for i in range(dim_z)], dim=2)
-            xx_channel = xx_channel.repeat(batch_size_shape, 1, 1, 1, 1)
-
-            yz_channel = torch.matmul(yz_range, yy_ones)
-            yz_channel = yz_channel.permute(0, 1, 3, 4, 2)
-            yy_channel = torch.cat([yz_channel + i for i in range(dim_x)], dim=4)
-            yy_channel = yy_channel.repeat(batch_size_shape, 1, 1, 1, 1)
-
-            zx_channel = torch.matmul(zx_range, zz_ones)
-            zx_channel = zx_channel.permute(0, 1, 4, 2, 3)
-            zz_channel = torch.cat([zx_channel + i for i in range(dim_y)], dim=3)
-            zz_channel = zz_channel.repeat(batch_size_shape, 1, 1, 1, 1)
-
-            if torch.cuda.is_available and self.use_cuda:
-                input_tensor = input_tensor.cuda()
-                xx_channel = xx_channel.cuda()
-                yy_channel = yy_channel.cuda()
-                zz_channel = zz_channel.cuda()
-            out = torch.cat([input_tensor, xx_channel, yy_channel, zz_channel], dim=1)
-
-            if self.with_r:
-                rr = torch.sqrt(torch.pow(xx_channel - 0.5, 2) +
-                                torch.pow(yy_channel - 0.5, 2) +
-                                torch.pow(zz_channel - 0.5, 2))
-                out = torch.cat([out, rr], dim=1)
-        else:
+        if input_tensor.dim() != self.rank + 2:
             raise NotImplementedError
-
-        return out
+        coords = self.coord_channels(input_tensor.shape[2:], input_tensor.device)
+        coords = coords.expand((input_tensor.shape[0],) + coords.shape[1:])
+        return torch.cat([input_tensor, coords], dim=1)
 
 
 class CoordConv1d(conv.Conv1d):
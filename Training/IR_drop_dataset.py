@@ -3,23 +3,170 @@ import torch
 import numpy as np
 from torch.utils.data import (
     Dataset,
+    get_worker_info,
 )
 import random
+import re
+import json
+import hashlib
 import torchvision.transforms.functional as TF
+from packed_dataset import PackedDataset, is_packed
+
+
+def disk_read_bytes():
+    # bytes this process and its live children (DataLoader workers) fetched from storage, page faults
+    # on memory-mapped files included; page cache hits are not counted (Linux /proc only)
+    pids = [os.getpid()]
+    try:
+        for task in os.listdir('/proc/self/task'):
+            with open(f'/proc/self/task/{task}/children') as f:
+                pids.extend(int(pid) for pid in f.read().split())
+    except OSError:
+        pass
+    total = 0
+    for pid in pids:
+        try:
+            with open(f'/proc/{pid}/io') as f:
+                for line in f:
+                    if line.startswith('read_bytes:'):
+                        total += int(line.split()[1])
+        except OSError:
+            continue
+    return total
+
+
+## Name-aligned sample index and design-family splits
+
+INDEX_NAME = 'dataset_index.json'
+
+
+def directory_stamp(root_dir):
+    # changes whenever a file is added to, removed from or renamed in feature/ or label/
+    stamp = []
+    for sub in ('feature', 'label'):
+        st = os.stat(os.path.join(root_dir, sub))
+        stamp.append([st.st_ino, st.st_mtime_ns])
+    return stamp
+
+
+def build_index(root_dir):
+    # feature/<name>.npy is paired with label/<name>.npy by name, in sorted name order
+    features = {os.path.splitext(f)[0]: f for f in os.listdir(os.path.join(root_dir, 'feature'))}
+    labels = {os.path.splitext(f)[0]: f for f in os.listdir(os.path.join(root_dir, 'label'))}
+    names = sorted(features.keys() & labels.keys())
+    unpaired = len(features) + len(labels) - 2 * len(names)
+    if unpaired:
+        print(f"{root_dir}: {unpaired} feature/label files without a partner are left out")
+    return {'version': 1, 'stamp': directory_stamp(root_dir), 'names': names,
+            'feature_files': [features[name] for name in names], 'label_files': [labels[name] for name in names]}
+
+
+def load_index(root_dir):
+    # the cached index is reused while feature/ and label/ are unchanged (two stat() calls)
+    index_path = os.path.join(root_dir, INDEX_NAME)
+    if os.path.exists(index_path):
+        with open(index_path, 'r') as f:
+            index = json.load(f)
+        if index.get('version') == 1 and index['stamp'] == directory_stamp(root_dir):
+            return index
+    index = build_index(root_dir)
+    try:
+        with open(index_path + '.tmp', 'w') as f:
+            json.dump(index, f)
+        os.replace(index_path + '.tmp', index_path)
+    except OSError:
+        pass  # read-only dataset, rebuild next time
+    return index
+
+
+def design_family(name):
+    # designs of one family differ only by trailing variant numbers, e.g. ac97_ctrl_12 -> ac97_ctrl
+    return re.sub(r'([_\-.]?\d+)+$', '', name) or name
+
+
+def split_by_family(names, fractions=(0.8, 0.1, 0.1), family_of=design_family):
+    # train / val / test names; a family lands in one split only, chosen from a hash of its name,
+    # so the assignment is deterministic and does not move when designs are added
+    splits = {'train': [], 'val': [], 'test': []}
+    for name in names:
+        h = int(hashlib.sha1(family_of(name).encode()).hexdigest()[:8], 16) / 2 ** 32
+        if h < fractions[0]:
+            splits['train'].append(name)
+        elif h < fractions[0] + fractions[1]:
+            splits['val'].append(name)
+        else:
+            splits['test'].append(name)
+    return splits
+
+
+# bytes handed out by __getitem__ are counted in a shared-memory tensor with one slot per DataLoader
+# worker (slot 0: the main process). Shared tensors reach the workers under fork, spawn and forkserver
+# alike, and one writer per slot needs no lock.
+IO_SLOTS = 257
+
 
 class IRdropDataset(Dataset):
-    def __init__(self, root_dir,transform=None):
+    def __init__(self, root_dir,transform=None, cache=False, split=None, split_file=None):
         self.transform = transform
         self.root_dir = root_dir
-        self.feature_files = os.listdir(self.root_dir+'/feature')
-        self.label_files = os.listdir(self.root_dir+'/label')
+        # a packed dataset (packed_dataset.py) or the feature/ and label/ folders of stacked .npy files;
+        # packed samples are zero-copy torch views of the memory-mapped channels-first shards
+        # (float32 or float16 as packed), so the training loop casts them on the device
+        self.packed = PackedDataset(root_dir, mmap_mode='c') if is_packed(root_dir) else None
+        if self.packed is not None:
+            self.names = list(self.packed.names)
+        else:
+            index = load_index(root_dir)
+            self.names = index['names']
+            file_of = dict(zip(self.names, zip(index['feature_files'], index['label_files'])))
+
+        # split: 'train' / 'val' / 'test' of split_file (JSON {split: [names]}) or of split_by_family
+        if split is not None:
+            if split_file is not None:
+                with open(split_file, 'r') as f:
+                    selected = set(json.load(f)[split])
+            else:
+                splits = split_by_family(self.names)
+                if not all(splits.values()):
+                    # too few families to fill every split: hash the design names instead
+                    print(f"{root_dir}: the family split leaves {[k for k, v in splits.items() if not v]} empty, "
+                          f"splitting by design name instead")
+                    splits = split_by_family(self.names, family_of=lambda name: name)
+                selected = set(splits[split])
+            self.names = [name for name in self.names if name in selected]
+            if not self.names:
+                raise ValueError(f"{root_dir}: the {split} split holds no designs")
+        if self.packed is not None:
+            self.rows = [self.packed.position[name] for name in self.names]
+        else:
+            self.feature_files = [file_of[name][0] for name in self.names]
+            self.label_files = [file_of[name][1] for name in self.names]
+
+        # bytes handed out by __getitem__, shared with the DataLoader workers
+        self.bytes_requested = torch.zeros(IO_SLOTS, dtype=torch.int64).share_memory_()
+        self.disk_read_start = disk_read_bytes()
+        # cache=True loads every sample once into two stacked tensors in shared memory; DataLoader
+        # workers (forked or spawned, persistent or not) then index them instead of reading files
+        self.cached_features = None
+        self.cached_labels = None
+        if cache:
+            self.load_cache()
     def __len__(self):
-        return len(self.feature_files)
+        return len(self.names)
     def __getitem__(self, index):
-        features_name = self.feature_files[index]
-        feature = self.feature_data(features_name)
-        label_name = self.label_files[index]
-        label = self.label_data(label_name)
+        if self.cached_features is not None:
+            feature = self.cached_features[index]
+            label = self.cached_labels[index]
+        elif self.packed is not None:
+            feature = torch.from_numpy(self.packed.feature(self.rows[index]))
+            label = torch.from_numpy(self.packed.label(self.rows[index]))
+        else:
+            features_name = self.feature_files[index]
+            feature = self.feature_data(features_name)
+            label_name = self.label_files[index]
+            label = self.label_data(label_name)
+        worker = get_worker_info()
+        self.bytes_requested[0 if worker is None else 1 + worker.id % (IO_SLOTS - 1)] += feature.nbytes + label.nbytes
         if self.transform == True:
             if random.random() > 0.5:
                 feature = TF.hflip(feature)
@@ -35,6 +182,33 @@ class IRdropDataset(Dataset):
             #     label = TF.rotate(label, 270)
         return feature,label
 
+    def load_cache(self):
+        # needs the sample lists (rows / feature_files) built in __init__; an empty split stays uncached
+        if not self.names:
+            return
+        if self.packed is not None:
+            features = torch.empty((len(self.rows),) + self.packed.feature(0).shape,
+                                   dtype=torch.from_numpy(self.packed.feature(0)).dtype)
+            labels = torch.empty((len(self.rows),) + self.packed.label(0).shape, dtype=features.dtype)
+            for i, row in enumerate(self.rows):
+                features[i] = torch.from_numpy(self.packed.feature(row))
+                labels[i] = torch.from_numpy(self.packed.label(row))
+        else:
+            features = torch.stack([self.feature_data(name) for name in self.feature_files])
+            labels = torch.stack([self.label_data(name) for name in self.label_files])
+        self.cached_features = features.share_memory_()
+        self.cached_labels = labels.share_memory_()
+
+    def io_stats(self, reset=True):
+        # bytes requested vs. bytes actually read from disk since the last reset (e.g. one epoch);
+        # a warm page cache shows disk_read_bytes far below bytes_requested
+        stats = {'bytes_requested': int(self.bytes_requested.sum()),
+                 'disk_read_bytes': disk_read_bytes() - self.disk_read_start}
+        if reset:
+            self.bytes_requested.zero_()
+            self.disk_read_start = disk_read_bytes()
+        return stats
+
     def feature_data(self,f_name):
         f = torch.transpose(torch.as_tensor(np.load(f"{self.root_dir}/feature/{f_name}")), 0, 2)
         f = torch.transpose(f, 1, 2)
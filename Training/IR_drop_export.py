@@ -0,0 +1,162 @@
+import os
+import json
+import time
+import argparse
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from IR_drop_predict import load_model
+
+
+# Export of IRdropModel to TorchScript and ONNX, inference backends running the exported graphs,
+# and a latency / throughput benchmark of eager vs. TorchScript vs. ONNX Runtime on the CPU.
+#
+# The exported graph is the whole prediction: (B, 26, 256, 256) features -> (B, 1, 256, 256) IR drop
+# probabilities (sigmoid and the final bilinear resize included), with a dynamic batch dimension.
+
+
+class ExportWrapper(nn.Module):
+    def __init__(self, model, size=256):
+        super(ExportWrapper, self).__init__()
+        self.model = model
+        self.size = size
+
+    def forward(self, features):
+        pred = torch.sigmoid(self.model(features))
+        return F.interpolate(pred, size=(self.size, self.size), mode='bilinear', align_corners=False)
+
+
+def export_torchscript(model, path, example):
+    # traced, so the AddCoords channels and the CEFPN / decoder shapes are fixed for 256 x 256 inputs;
+    # the batch dimension stays dynamic (the coordinate channels are expanded to the traced batch size)
+    wrapper = ExportWrapper(model).eval()
+    with torch.no_grad():
+        # one eager pass first fills the AddCoords caches, so the trace and its check run both see
+        # the coordinate channels as constants
+        wrapper(example)
+        traced = torch.jit.trace(wrapper, example)
+    traced = torch.jit.freeze(traced)
+    traced.save(path)
+    return path
+
+
+def export_onnx(model, path, example, opset=17):
+    torch.onnx.export(ExportWrapper(model).eval(), example, path, opset_version=opset,
+                      input_names=['features'], output_names=['ir_drop'],
+                      dynamic_axes={'features': {0: 'batch'}, 'ir_drop': {0: 'batch'}})
+    return path
+
+
+## Backends: callables mapping a (B, 26, 256, 256) float tensor to (B, 1, 256, 256) probabilities
+
+class EagerBackend(object):
+    def __init__(self, model, device='cpu', num_threads=None):
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        self.model = ExportWrapper(model).eval()
+        self.device = device
+
+    def __call__(self, features):
+        with torch.no_grad():
+            return self.model(features.to(self.device).float()).cpu()
+
+
+class TorchScriptBackend(object):
+    def __init__(self, path, device='cpu', num_threads=None):
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        self.model = torch.jit.load(path, map_location=device)
+        self.device = device
+
+    def __call__(self, features):
+        with torch.no_grad():
+            return self.model(features.to(self.device).float()).cpu()
+
+
+class OnnxBackend(object):
+    def __init__(self, path, num_threads=None):
+        import onnxruntime
+        options = onnxruntime.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+
+    def __call__(self, features):
+        features = features.detach().cpu().float().numpy()
+        return torch.from_numpy(self.session.run(['ir_drop'], {'features': features})[0])
+
+
+def load_backend(backend, path, device='cpu', num_threads=None):
+    # backend: 'eager' (path = state dict checkpoint), 'torchscript' (.pt) or 'onnx' (.onnx)
+    if backend == 'eager':
+        return EagerBackend(load_model(path, device), device, num_threads)
+    elif backend == 'torchscript':
+        return TorchScriptBackend(path, device, num_threads)
+    elif backend == 'onnx':
+        return OnnxBackend(path, num_threads)
+    raise ValueError(f'unknown backend: {backend}')
+
+
+def export(weight_path, output_dir, opset=17):
+    os.makedirs(output_dir, exist_ok=True)
+    model = load_model(weight_path, 'cpu')
+    example = torch.rand(2, 26, 256, 256)
+    paths = {'torchscript': export_torchscript(model, os.path.join(output_dir, 'irdrop.ts.pt'), example),
+             'onnx': export_onnx(model, os.path.join(output_dir, 'irdrop.onnx'), example, opset)}
+
+    # the exported graphs must agree with the eager model, also at a batch size not seen when tracing
+    check = torch.rand(3, 26, 256, 256)
+    reference = EagerBackend(model)(check)
+    for backend, path in paths.items():
+        error = (load_backend(backend, path)(check) - reference).abs().max().item()
+        print(f"{backend}: {path}, max abs difference to eager {error:.2e}")
+    return paths
+
+
+def benchmark(weight_path, export_dir, batch_sizes=(1, 2, 4, 8, 16, 32, 64), num_threads=None, repeat=5):
+    backends = {'eager': load_backend('eager', weight_path, num_threads=num_threads),
+                'torchscript': load_backend('torchscript', os.path.join(export_dir, 'irdrop.ts.pt'), num_threads=num_threads),
+                'onnx': load_backend('onnx', os.path.join(export_dir, 'irdrop.onnx'), num_threads=num_threads)}
+    results = []
+    for batch_size in batch_sizes:
+        features = torch.rand(batch_size, 26, 256, 256)
+        for name, backend in backends.items():
+            backend(features)  # warm-up
+            times = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                backend(features)
+                times.append(time.perf_counter() - start)
+            latency = float(np.median(times))
+            results.append({'backend': name, 'batch_size': batch_size, 'latency_ms': latency * 1000,
+                            'designs_per_second': batch_size / latency})
+            print(f"{name:>12} batch {batch_size:>3}: {latency * 1000:9.1f} ms, {batch_size / latency:8.2f} designs/s")
+    return results
+
+
+def parse_args():
+    description = "Export IRdropModel to TorchScript / ONNX and benchmark the CPU backends"
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("mode", choices=['export', 'benchmark'], help='Export the model, or benchmark eager / TorchScript / ONNX')
+    parser.add_argument("--weight_path", default="./model_weight/irdrop_train_weights.pt", type=str, help='The path of the model weight')
+    parser.add_argument("--export_dir", default="./exported", type=str, help='Where irdrop.ts.pt and irdrop.onnx are written / read')
+    parser.add_argument("--opset", default=17, type=int, help='ONNX opset version')
+    parser.add_argument("--num_threads", default=None, type=int, help='Intra-op threads of every backend')
+    parser.add_argument("--batch_sizes", default=[1, 2, 4, 8, 16, 32, 64], nargs='+', type=int, help='Benchmarked batch sizes')
+    parser.add_argument("--repeat", default=5, type=int, help='Timed runs per backend and batch size')
+    parser.add_argument("--result_path", default=None, type=str, help='Optional JSON file for the benchmark results')
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.mode == 'export':
+        export(args.weight_path, args.export_dir, args.opset)
+    else:
+        results = benchmark(args.weight_path, args.export_dir, args.batch_sizes, args.num_threads, args.repeat)
+        if args.result_path:
+            with open(args.result_path, 'w') as f:
+                json.dump(results, f, indent=1)
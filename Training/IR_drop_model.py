@@ -4,15 +4,25 @@ from CoordConv import AddCoords
 from CEFPN import CEFPN101
 import torch.nn.functional as F 
 
+def transposed_taps(n_in, kernel_size, stride, padding):
+    # (n_out, kernel_size) indicator of the kernel taps that reach each output row of a transposed
+    # convolution over n_in rows, out[o] = sum over i, k with o = i * stride - padding + k
+    n_out = (n_in - 1) * stride - 2 * padding + kernel_size
+    o = torch.arange(n_out)[:, None]
+    k = torch.arange(kernel_size)[None, :]
+    i = o + padding - k
+    return ((i % stride == 0) & (i >= 0) & (i < n_in * stride)).float()
+
+
 class Decoder(nn.Module):
-    def __init__(self,device):
+    def __init__(self,device=None, fast_global=True):
         super(Decoder, self).__init__()
-        if device =='cpu':
-            self.addcoord = AddCoords(rank=2,w=256,h=256,with_r=False,skiptile=True,use_cuda=False)
-            self.tile16 = AddCoords(rank=2,w=16,h=16,with_r=False,skiptile=False,use_cuda=False)
-        else:
-            self.addcoord = AddCoords(rank=2,w=128,h=128,with_r=False,skiptile=True)
-            self.tile16 = AddCoords(rank=2,w=16,h=16,with_r=False,skiptile=False)
+        # device is accepted for old callers only: the coordinate channels follow the input, so one
+        # module serves any device and input size (move it with .to())
+        # fast_global: convT1 of the tiled 1x1 global feature computed by broadcast (see global_context)
+        self.fast_global = fast_global
+        self.addcoord = AddCoords(rank=2,with_r=False,skiptile=True)
+        self.tile16 = AddCoords(rank=2,w=16,h=16,with_r=False,skiptile=False)
         self.convT1 = nn.ConvTranspose2d(256+2, 128, kernel_size=4, stride=2, padding=1)
         self.convT2 = nn.ConvTranspose2d(256+2, 128, kernel_size=4, stride=2, padding=1)
         self.convT3 = nn.ConvTranspose2d(256+2, 64, kernel_size=4, stride=2, padding=1)
@@ -20,6 +30,25 @@ class Decoder(nn.Module):
         self.act = nn.ReLU(inplace=True)
         self.sigmoid = nn.Sigmoid()
 
+    def global_context(self, r5):
+        """
+        convT1(tile16(r5)) without materialising the tiled map: the input is constant over the 16x16
+        grid apart from the coordinate channels, so the feature part is r5 contracted with the kernel
+        once per tap and spread with the per-axis tap coverage, and the coordinate part does not
+        depend on the input at all
+        """
+        h, w = self.tile16.h, self.tile16.w
+        conv = self.convT1
+        n_feature = r5.shape[1]
+        taps_h = transposed_taps(h, conv.kernel_size[0], conv.stride[0], conv.padding[0]).to(r5.device)
+        taps_w = transposed_taps(w, conv.kernel_size[1], conv.stride[1], conv.padding[1]).to(r5.device)
+        per_tap = torch.einsum('bc,ckhw->bkhw', r5[:, :, 0, 0], conv.weight[:n_feature])
+        out = torch.einsum('bkhw,ph,qw->bkpq', per_tap, taps_h, taps_w)
+        coords = self.tile16.coord_channels((h, w), r5.device)
+        coord_out = F.conv_transpose2d(coords.to(out.dtype), conv.weight[n_feature:].to(out.dtype), conv.bias.to(out.dtype),
+                                       stride=conv.stride, padding=conv.padding)
+        return out + coord_out
+
     def forward(self, feature):
         """
         r2 torch.Size([2, 256, 128, 128])
@@ -27,7 +56,10 @@ class Decoder(nn.Module):
         r4 torch.Size([2, 256, 32, 32])
         r5 torch.Size([2, 256, 1, 1])
         """
-        d1 = self.act(self.convT1(self.tile16(feature[-1])))
+        if self.fast_global and feature[-1].shape[-2:] == (1, 1):
+            d1 = self.act(self.global_context(feature[-1]))
+        else:
+            d1 = self.act(self.convT1(self.tile16(feature[-1])))
 
         # Upsample feature[-2] to match d1 size
         upscaled_feature = F.interpolate(self.addcoord(feature[-2]), size=d1.shape[-2:], mode='bilinear', align_corners=False)
@@ -47,10 +79,10 @@ class Decoder(nn.Module):
         return output
 
 class IRdropModel(nn.Module):
-    def __init__(self,in_channel,device):
+    def __init__(self,in_channel,device=None, fast_global=True):
         super(IRdropModel, self).__init__()
         self.encoder = CEFPN101(in_channel,device)
-        self.decoder = Decoder(device)
+        self.decoder = Decoder(device, fast_global)
     def forward(self,x):
         x = self.encoder(x)
         x = self.decoder(x)
@@ -58,4 +90,3 @@ class IRdropModel(nn.Module):
     def sigmoid(self,x):
         x = torch.sigmoid(x)
         return x
-
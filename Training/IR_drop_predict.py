@@ -1,63 +1,85 @@
 import os
+import glob
+import json
+import time
 import argparse
 import numpy as np
 import torch
+from torch.utils.data import Dataset, DataLoader
 from IR_drop_model import IRdropModel
-import cv2
 import matplotlib.pyplot as plt
 import pandas as pd
 import torch.nn.functional as F 
+from packed_dataset import PackedDataset, is_packed
+from preprocess import FEATURES, load_map, normalize_channels, preprocess, resize_stack, stack_maps
+
+
+def load_model(model_path, device):
+    # one device-independent model: the same checkpoint loads onto CPU or any GPU
+    model = IRdropModel(in_channel=26).to(device)
+    checkpoint = torch.load(model_path, map_location=device)
+    model.load_state_dict(checkpoint)
+    model.eval()
+    return model
+
 
 class IRDropPrediction():
-    def __init__(self, datapath, features, model_path, device, ground_truth_path=None):
+    def __init__(self, datapath, features, model_path, device, ground_truth_path=None, design=None, model=None,
+                 backend='eager', num_threads=None):
         super(IRDropPrediction, self).__init__()
         self.datapath = datapath
         self.FeaturePathList = features
-        self.feature = self.data_process(self.FeaturePathList).unsqueeze(0).to(device)
-        self.model = IRdropModel(in_channel=26, device=device).to(device)
-        checkpoint = torch.load(model_path)
-        self.model.load_state_dict(checkpoint)
-        self.model.eval()
+        # datapath is either one extracted design folder or a packed dataset holding `design`
+        self.packed = PackedDataset(datapath) if is_packed(datapath) else None
+        if self.packed is not None:
+            if design not in self.packed.position:
+                raise ValueError(f"{datapath} is a packed dataset, choose a design to predict with design= "
+                                 f"(--design): {sorted(self.packed.position)}")
+            self.design_index = self.packed.position[design]
+            self.feature = torch.as_tensor(self.packed.feature(self.design_index)).type(torch.float32).unsqueeze(0).to(device)
+        else:
+            self.feature = self.data_process(self.FeaturePathList).unsqueeze(0).to(device)
+        # an already loaded model (load_model) can be shared between predictions; with backend
+        # 'torchscript' / 'onnx' model_path is a graph exported by IR_drop_export.py instead
+        self.runner = None
+        if backend == 'eager':
+            self.model = model if model is not None else load_model(model_path, device)
+            if num_threads:
+                torch.set_num_threads(num_threads)
+        else:
+            from IR_drop_export import load_backend
+            self.runner = load_backend(backend, model_path, device, num_threads)
+            self.model = None
         self.device = device
         self.ground_truth = None
 
         if ground_truth_path:
             self.ground_truth = self.load_ground_truth(ground_truth_path)
+        elif self.packed is not None and self.packed.has_label(self.design_index):
+            self.ground_truth = torch.as_tensor(self.packed.label(self.design_index)[0]).type(torch.float32)
 
     def resize_cv2(self, input):
-        output = cv2.resize(input, (256, 256), interpolation=cv2.INTER_AREA)
-        return output
+        return resize_stack(input[None])[0]
 
     def std(self, input):
-        if input.max() == 0:
-            return input
-        else:
-            result = (input - input.min()) / (input.max() - input.min())
-            return result
+        return normalize_channels(input[None])[0]
 
     def data_process(self, FeaturePathList):
-        features = []
-        for feature_name in FeaturePathList:
-            name = os.listdir(os.path.join(self.datapath, feature_name))[0]
-            feature = np.load(os.path.join(self.datapath, feature_name, name))
-            if feature_name == "power_t":
-                for i in range(20):
-                    slice = feature[i, :, :]
-                    features.append(torch.as_tensor(self.std(self.resize_cv2(slice))))
-            else:
-                feature = self.std(self.resize_cv2(feature.squeeze()))
-                features.append(torch.as_tensor(feature))
-        features = torch.stack(features).type(torch.float32)
-        return features
+        # the same batched resize + per-channel normalization the packed dataset builder uses
+        stack = stack_maps([load_map(self.datapath, feature_name) for feature_name in FeaturePathList])
+        return torch.from_numpy(preprocess(stack))
 
     def load_ground_truth(self, ground_truth_path):
         ground_truth = np.load(ground_truth_path)
-        ground_truth = torch.tensor(self.std(self.resize_cv2(ground_truth)), dtype=torch.float32)
+        ground_truth = torch.from_numpy(preprocess(stack_maps([ground_truth]))[0])
         return ground_truth
 
     def Prediction(self, irdrop_threshold):
         self.irdrop_threshold = irdrop_threshold
-        with torch.cuda.amp.autocast() if self.device != 'cpu' else torch.no_grad():
+        if self.runner is not None:
+            self.pred = self.runner(self.feature)
+            return self.pred
+        with torch.cuda.amp.autocast() if torch.device(self.device).type == 'cuda' else torch.no_grad():
             self.pred = self.model(self.feature)
             self.pred = self.model.sigmoid(self.pred)
             self.pred = F.interpolate(self.pred, size=(256, 256), mode='bilinear', align_corners=False)
@@ -93,30 +115,120 @@ class IRDropPrediction():
             np.save(f"{output_path}/GroundTruthArray", self.ground_truth.detach().cpu().numpy())
 
 
+## Batch prediction over many designs
+
+class DesignDataset(Dataset):
+    # preprocessed features of design folders, or of the designs of a packed dataset
+    def __init__(self, designs, features=FEATURES):
+        self.features = features
+        self.packed = PackedDataset(designs[0], mmap_mode='c') if len(designs) == 1 and is_packed(designs[0]) else None
+        self.designs = list(self.packed.names) if self.packed is not None else designs
+        self.names = [os.path.basename(os.path.normpath(design)) for design in self.designs]
+
+    def __len__(self):
+        return len(self.designs)
+
+    def __getitem__(self, index):
+        if self.packed is not None:
+            return torch.from_numpy(self.packed.feature(index))
+        stack = stack_maps([load_map(self.designs[index], feature_name) for feature_name in self.features])
+        return torch.from_numpy(preprocess(stack))
+
+
+def predict_batch(model, features, device):
+    # (B, 26, 256, 256) features -> (B, 256, 256) predicted IR drop maps on the CPU
+    features = features.to(device, non_blocking=True).float()
+    with torch.cuda.amp.autocast() if torch.device(device).type == 'cuda' else torch.no_grad():
+        pred = model.sigmoid(model(features))
+        pred = F.interpolate(pred, size=(256, 256), mode='bilinear', align_corners=False)
+    return pred[:, 0].float().cpu()
+
+
+def batch_predict(designs, model_path, device, output_path, features=FEATURES, batch_size=16, num_workers=4, model=None,
+                  backend='eager', num_threads=None):
+    # Predicts every design with one model load. DataLoader workers preprocess the next batches while
+    # the model runs, and all maps go into one (N, 256, 256) predictions.npy (+ predictions.json names).
+    # backend / num_threads as for IRDropPrediction: 'torchscript' / 'onnx' run an exported graph.
+    dataset = DesignDataset(designs, features)
+    loader_args = {'num_workers': num_workers, 'pin_memory': device != 'cpu'}
+    if num_workers > 0:
+        loader_args['prefetch_factor'] = 2
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=False, **loader_args)
+    if backend == 'eager':
+        model = model if model is not None else load_model(model_path, device)
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        run = lambda batch: predict_batch(model, batch, device)
+    else:
+        from IR_drop_export import load_backend
+        runner = load_backend(backend, model_path, device, num_threads)
+        run = lambda batch: runner(batch)[:, 0].float()
+
+    os.makedirs(output_path, exist_ok=True)
+    predictions = np.lib.format.open_memmap(os.path.join(output_path, 'predictions.npy'), mode='w+',
+                                            dtype=np.float32, shape=(len(dataset), 256, 256))
+    start = time.perf_counter()
+    done = 0
+    with torch.no_grad():
+        for batch in loader:
+            predictions[done:done + len(batch)] = run(batch).numpy()
+            done += len(batch)
+    predictions.flush()
+    elapsed = time.perf_counter() - start
+    with open(os.path.join(output_path, 'predictions.json'), 'w') as f:
+        json.dump({'designs': dataset.names, 'seconds': elapsed}, f)
+    print(f"Predicted {done} designs in {elapsed:.1f}s ({done / elapsed:.2f} designs/s)")
+    return {'designs': done, 'seconds': elapsed, 'designs_per_second': done / elapsed}
+
+
+def expand_designs(patterns):
+    # design folders from paths / glob patterns, or a single packed dataset passed through as is
+    packed = [pattern for pattern in patterns if is_packed(pattern)]
+    if packed:
+        if len(patterns) > 1:
+            raise ValueError(f"a packed dataset ({packed[0]}) cannot be combined with other designs: {patterns}")
+        return packed
+    designs = []
+    for pattern in patterns:
+        designs.extend(sorted(path for path in glob.glob(pattern) if os.path.isdir(path)))
+    return designs
+
+
 def parse_args():
     description = "Input the Path for Prediction"
     parser = argparse.ArgumentParser(description=description)
-    parser.add_argument("--data_path", default="./data/1", type=str, help='The path of the data file')
+    parser.add_argument("--data_path", default="./data/1", type=str, help='The path of the data file (a design folder or a packed dataset)')
+    parser.add_argument("--design", default=None, type=str, help='The design to predict when data_path is a packed dataset')
     parser.add_argument("--fig_save_path", default="./predict_save_img", type=str, help='The path to save the figure')
     parser.add_argument("--weight_path", default="./model_weight/irdrop_train_weights.pt", type=str, help='The path of the model weight')
     parser.add_argument("--output_path", default="./output", type=str, help='The output path')
     parser.add_argument("--irdrop_threshold", default=0.1, type=float, help='irdrop_threshold [0,1]')
     parser.add_argument("--device", default='cpu', type=str, help='If you have GPU, type "cuda" for faster execution')
-    parser.add_argument("--ground_truth_path", default="./output/10.npy", type=str, help='The path of the original IR drop data file')
+    parser.add_argument("--ground_truth_path", default=None, type=str, help='The path of the original IR drop data file (default: the label stored in a packed dataset)')
+    parser.add_argument("--backend", default='eager', choices=['eager', 'torchscript', 'onnx'], help='Run the eager model, or an exported graph given as weight_path (int8 checkpoints of IR_drop_quantize.py are torchscript)')
+    parser.add_argument("--num_threads", default=None, type=int, help='CPU threads of the backend')
+    parser.add_argument("--designs", default=None, nargs='+', type=str, help='Batch mode: design folders / glob patterns, or one packed dataset')
+    parser.add_argument("--batch_size", default=16, type=int, help='Batch mode: designs per forward pass')
+    parser.add_argument("--num_workers", default=4, type=int, help='Batch mode: DataLoader workers preprocessing the next batches')
     args = parser.parse_args()
     return args
 
 
 if __name__ == "__main__":
     args = parse_args()
-    feature_list = ['power_i', 'power_s', 'power_sca', 'power_all', 'power_t', 'VDD_Map', 'decap']
-
-    predictionSystem = IRDropPrediction(datapath=args.data_path, features=feature_list,
-                                        model_path=args.weight_path, device=args.device,
-                                        ground_truth_path=args.ground_truth_path)
-    pred = predictionSystem.Prediction(irdrop_threshold=args.irdrop_threshold)
-    predictionSystem.save(args.output_path)
-
-    # Plot and compare prediction with ground truth if path is provided
-    if args.fig_save_path:
-        predictionSystem.compare_prediction_with_ground_truth(fig_save_path=args.fig_save_path)
+    feature_list = FEATURES
+
+    if args.designs:
+        batch_predict(expand_designs(args.designs), args.weight_path, args.device, args.output_path,
+                      feature_list, args.batch_size, args.num_workers, backend=args.backend, num_threads=args.num_threads)
+    else:
+        predictionSystem = IRDropPrediction(datapath=args.data_path, features=feature_list,
+                                            model_path=args.weight_path, device=args.device,
+                                            ground_truth_path=args.ground_truth_path, design=args.design,
+                                            backend=args.backend, num_threads=args.num_threads)
+        pred = predictionSystem.Prediction(irdrop_threshold=args.irdrop_threshold)
+        predictionSystem.save(args.output_path)
+
+        # Plot and compare prediction with ground truth if it is available
+        if args.fig_save_path and predictionSystem.ground_truth is not None:
+            predictionSystem.compare_prediction_with_ground_truth(fig_save_path=args.fig_save_path)
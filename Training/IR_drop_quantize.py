@@ -0,0 +1,182 @@
+import io
+import copy
+import json
+import time
+import argparse
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from torch.nn.utils.fusion import fuse_conv_bn_eval
+from torch.ao.quantization import get_default_qconfig_mapping
+from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+from pytorch_msssim import ssim
+from IR_drop_dataset import IRdropDataset
+from IR_drop_predict import load_model
+from IR_drop_export import ExportWrapper, export_torchscript
+
+
+# Post-training static int8 quantization of the CEFPN encoder for CPU inference.
+#
+# The four Bottleneck stages (layer1-4, almost all of the encoder's convolutions) are quantized with
+# FX graph mode: conv-BN-ReLU fusion, observers calibrated on training samples, int8 conversion. Their
+# inputs and outputs stay float, so the CoordConv stem, the feature pyramid and the decoder run as
+# before (the stem's BatchNorm is folded into its convolution). The result is saved as a frozen
+# TorchScript graph that IRDropPrediction loads with backend='torchscript'.
+
+STAGES = ('layer1', 'layer2', 'layer3', 'layer4')
+
+
+def fuse_stem(model):
+    model.encoder.conv1.conv = fuse_conv_bn_eval(model.encoder.conv1.conv, model.encoder.bn1)
+    model.encoder.bn1 = nn.Identity()
+    return model
+
+
+def stage_inputs(model, features):
+    # example input of every quantized stage, captured from one float forward pass
+    inputs = {}
+    hooks = [getattr(model.encoder, name).register_forward_hook(
+        lambda module, args, output, name=name: inputs.setdefault(name, args[0].detach())) for name in STAGES]
+    with torch.no_grad():
+        model(features)
+    for hook in hooks:
+        hook.remove()
+    return inputs
+
+
+def quantize_model(model, calibration_batches, engine='fbgemm'):
+    # model: float IRdropModel on the CPU (left unchanged, a copy is quantized),
+    # calibration_batches: iterable of (B, 26, 256, 256) features
+    torch.backends.quantized.engine = engine
+    model = fuse_stem(copy.deepcopy(model).eval())
+    qconfig_mapping = get_default_qconfig_mapping(engine)
+    calibration_batches = list(calibration_batches)
+    examples = stage_inputs(model, calibration_batches[0])
+    for name in STAGES:
+        prepared = prepare_fx(getattr(model.encoder, name), qconfig_mapping, example_inputs=(examples[name],))
+        setattr(model.encoder, name, prepared)
+    with torch.no_grad():
+        for features in calibration_batches:
+            model(features)
+    for name in STAGES:
+        setattr(model.encoder, name, convert_fx(getattr(model.encoder, name)))
+    return model
+
+
+def sample_indices(n, seed=0):
+    return torch.randperm(n, generator=torch.Generator().manual_seed(seed)).tolist()
+
+
+def sample_batches(dataset, indices, batch_size):
+    # features and labels of the dataset samples at indices, in batches
+    for start in range(0, len(indices), batch_size):
+        samples = [dataset[i] for i in indices[start:start + batch_size]]
+        yield (torch.stack([feature for feature, _ in samples]).float(),
+               torch.stack([label for _, label in samples]).float())
+
+
+def hotspot_f1(pred, label, threshold):
+    pred_hot = pred >= threshold
+    label_hot = label >= threshold
+    tp = (pred_hot & label_hot).sum().item()
+    fp = (pred_hot & ~label_hot).sum().item()
+    fn = (~pred_hot & label_hot).sum().item()
+    return 2 * tp / (2 * tp + fp + fn) if tp + fp + fn else 1.0
+
+
+def evaluate(predict, batches, hotspot_threshold=0.9):
+    # MAE, SSIM and hotspot F1 of predicted vs. label maps, plus the median batch latency
+    preds, labels, times = [], [], []
+    for features, label in batches:
+        start = time.perf_counter()
+        with torch.no_grad():
+            pred = predict(features)
+        times.append(time.perf_counter() - start)
+        preds.append(F.interpolate(pred, size=label.shape[-2:], mode='bilinear', align_corners=False))
+        labels.append(label)
+    pred = torch.cat(preds)
+    label = torch.cat(labels)
+    return {'mae': (pred - label).abs().mean().item(),
+            'ssim': ssim(pred, label, data_range=1, size_average=True).item(),
+            'hotspot_f1': hotspot_f1(pred, label, hotspot_threshold),
+            'latency_ms': float(np.median(times)) * 1000}
+
+
+def model_bytes(model):
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.getbuffer().nbytes
+
+
+def run(weight_path, data_path, output_path, n_calibration=64, n_eval=64, batch_size=8,
+        engine='fbgemm', num_threads=None, hotspot_threshold=0.9, split=None):
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    # evaluation samples are always held out from calibration: the val designs of the family split,
+    # or otherwise disjoint parts of one permutation of the dataset
+    if split == 'family':
+        calibration_set = IRdropDataset(data_path, split='train')
+        eval_set = IRdropDataset(data_path, split='val')
+        calibration_indices = sample_indices(len(calibration_set))[:n_calibration]
+        eval_indices = sample_indices(len(eval_set))[:n_eval]
+    else:
+        calibration_set = eval_set = IRdropDataset(data_path)
+        indices = sample_indices(len(eval_set))
+        eval_indices = indices[:n_eval]
+        calibration_indices = indices[n_eval:n_eval + n_calibration]
+    if not calibration_indices or not eval_indices:
+        raise ValueError(f'{data_path}: too few designs for separate calibration and evaluation samples')
+
+    float_model = load_model(weight_path, 'cpu')
+    float_size = model_bytes(float_model)
+    eval_batches = list(sample_batches(eval_set, eval_indices, batch_size))
+    float_metrics = evaluate(ExportWrapper(float_model).eval(), eval_batches, hotspot_threshold)
+
+    calibration = (features for features, _ in sample_batches(calibration_set, calibration_indices, batch_size))
+    int8_model = quantize_model(float_model, calibration, engine)
+    int8_metrics = evaluate(ExportWrapper(int8_model).eval(), eval_batches, hotspot_threshold)
+    int8_size = model_bytes(int8_model)
+
+    export_torchscript(int8_model, output_path, eval_batches[0][0])
+    report = {
+        'float': dict(float_metrics, model_bytes=float_size),
+        'int8': dict(int8_metrics, model_bytes=int8_size),
+        'delta': {key: int8_metrics[key] - float_metrics[key] for key in ('mae', 'ssim', 'hotspot_f1')},
+        'speedup': float_metrics['latency_ms'] / int8_metrics['latency_ms'],
+        'size_ratio': int8_size / float_size,
+        'checkpoint': output_path,
+    }
+    print(f"{'':>6} {'MAE':>8} {'SSIM':>8} {'F1':>8} {'ms/batch':>10} {'MiB':>8}")
+    for name in ('float', 'int8'):
+        r = report[name]
+        print(f"{name:>6} {r['mae']:8.4f} {r['ssim']:8.4f} {r['hotspot_f1']:8.4f} {r['latency_ms']:10.1f} {r['model_bytes'] / 2**20:8.1f}")
+    print(f"int8: {report['speedup']:.2f}x faster, {report['size_ratio']:.2f}x the size, saved to {output_path}")
+    return report
+
+
+def parse_args():
+    description = "Post-training int8 quantization of IRdropModel for CPU inference"
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--weight_path", default="./model_weight/irdrop_train_weights.pt", type=str, help='The path of the float model weight')
+    parser.add_argument("--data_path", default="/mnt/research/Hu_Jiang/Students/Poudel_Bidhan/Dataset2/", type=str, help='Training dataset used for calibration and evaluation')
+    parser.add_argument("--output_path", default="./model_weight/irdrop_int8.ts.pt", type=str, help='The quantized TorchScript checkpoint')
+    parser.add_argument("--n_calibration", default=64, type=int, help='Calibration samples')
+    parser.add_argument("--n_eval", default=64, type=int, help='Evaluation samples')
+    parser.add_argument("--batch_size", default=8, type=int, help='Batch size of calibration and evaluation')
+    parser.add_argument("--engine", default='fbgemm', choices=['fbgemm', 'x86', 'qnnpack'], help='Quantized engine (qnnpack on ARM)')
+    parser.add_argument("--num_threads", default=None, type=int, help='CPU threads')
+    parser.add_argument("--hotspot_threshold", default=0.9, type=float, help='Normalized IR drop at which a gcell counts as a hotspot')
+    parser.add_argument("--split", default=None, choices=['family'], help='Calibrate on the train and evaluate on the val designs of the family split (default: disjoint random samples)')
+    parser.add_argument("--report_path", default=None, type=str, help='Optional JSON file for the report')
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = run(args.weight_path, args.data_path, args.output_path, args.n_calibration, args.n_eval,
+                 args.batch_size, args.engine, args.num_threads, args.hotspot_threshold, args.split)
+    if args.report_path:
+        with open(args.report_path, 'w') as f:
+            json.dump(report, f, indent=1)
@@ -0,0 +1,232 @@
+import io
+import json
+import time
+import base64
+import queue
+import argparse
+import threading
+import collections
+import urllib.request
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import torch
+from IR_drop_predict import FEATURES, load_model, predict_batch
+from preprocess import load_map, preprocess, stack_maps
+
+
+# Long-running IR drop prediction server on localhost. The model is loaded once; concurrent requests
+# are queued and a single batcher thread runs them together, up to max_batch designs or max_wait_ms
+# after the first request of a batch, whichever comes first.
+#
+#   POST /predict  {"design_path": "..."} or {"features": <base64 .npy of raw (26, H, W) maps>}, with
+#                  "preprocessed": true for features already resized / normalized to (26, 256, 256);
+#                  optional "threshold" (default 0.1) and "top_k" (default 100)
+#                  -> {"map": <base64 .npy of (256, 256) float32>, "hotspots": [[x, y, ir], ...], "latency_ms": ...}
+#   GET  /stats    -> request count, batches, mean batch size, p50 / p99 latency in ms
+
+
+def encode_array(array):
+    buffer = io.BytesIO()
+    np.save(buffer, array)
+    return base64.b64encode(buffer.getvalue()).decode()
+
+
+def decode_array(data):
+    return np.load(io.BytesIO(base64.b64decode(data)))
+
+
+def hotspots(ir_map, threshold, top_k):
+    # gcells with predicted IR drop >= threshold, largest first
+    x, y = np.nonzero(ir_map >= threshold)
+    order = np.argsort(-ir_map[x, y], kind='stable')[:top_k]
+    return [[int(x[i]), int(y[i]), float(ir_map[x[i], y[i]])] for i in order]
+
+
+INPUT_SHAPE = (26, 256, 256)
+
+
+class PredictionServer(object):
+    def __init__(self, model_path, device='cpu', max_batch=16, max_wait_ms=10, features=FEATURES, history=10000):
+        self.model = load_model(model_path, device)
+        self.device = device
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.features = features
+        self.requests = queue.Queue()
+        self.latencies = collections.deque(maxlen=history)
+        self.n_requests = 0
+        self.n_batches = 0
+        self.lock = threading.Lock()
+        self.batcher = threading.Thread(target=self.run_batches, daemon=True)
+        self.batcher.start()
+
+    def prepare(self, request):
+        # runs in the request's handler thread, so a bad request is rejected on its own before it
+        # can join (and fail) a batch
+        if 'features' in request:
+            stack = decode_array(request['features'])
+            if not request.get('preprocessed', False):
+                stack = preprocess(stack_maps([stack]))
+        else:
+            stack = preprocess(stack_maps([load_map(request['design_path'], feature_name) for feature_name in self.features]))
+        if stack.shape != INPUT_SHAPE:
+            raise ValueError(f'features of shape {stack.shape}, expected {INPUT_SHAPE}')
+        return torch.from_numpy(np.ascontiguousarray(stack, dtype=np.float32))
+
+    def predict(self, feature):
+        # called from the HTTP handler threads; blocks until the batch holding this request ran
+        future = Future()
+        self.requests.put((feature, future))
+        return future.result()
+
+    def run_batches(self):
+        while True:
+            batch = [self.requests.get()]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.requests.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            self.run_batch(batch)
+            with self.lock:
+                self.n_batches += 1
+
+    def run_batch(self, batch):
+        try:
+            with torch.no_grad():
+                pred = predict_batch(self.model, torch.stack([feature for feature, _ in batch]), self.device).numpy()
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0][1].set_exception(e)
+            else:
+                # retry one by one, so only the request that fails gets the error
+                for request in batch:
+                    self.run_batch([request])
+            return
+        for (_, future), ir_map in zip(batch, pred):
+            future.set_result(ir_map)
+
+    def record(self, latency):
+        with self.lock:
+            self.n_requests += 1
+            self.latencies.append(latency)
+
+    def stats(self):
+        with self.lock:
+            latencies = np.array(self.latencies) * 1000
+            n_requests, n_batches = self.n_requests, self.n_batches
+        return {
+            'requests': n_requests,
+            'batches': n_batches,
+            'mean_batch_size': n_requests / n_batches if n_batches else 0,
+            'p50_ms': float(np.percentile(latencies, 50)) if latencies.size else None,
+            'p99_ms': float(np.percentile(latencies, 99)) if latencies.size else None,
+        }
+
+
+def make_handler(server):
+    class Handler(BaseHTTPRequestHandler):
+        def reply(self, code, body):
+            data = json.dumps(body).encode()
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == '/stats':
+                self.reply(200, server.stats())
+            else:
+                self.reply(404, {'error': f'unknown path {self.path}'})
+
+        def do_POST(self):
+            if self.path != '/predict':
+                self.reply(404, {'error': f'unknown path {self.path}'})
+                return
+            start = time.perf_counter()
+            try:
+                request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                ir_map = server.predict(server.prepare(request))
+            except Exception as e:
+                self.reply(400, {'error': f'{type(e).__name__}: {e}'})
+                return
+            latency = time.perf_counter() - start
+            server.record(latency)
+            self.reply(200, {'map': encode_array(ir_map),
+                             'hotspots': hotspots(ir_map, request.get('threshold', 0.1), request.get('top_k', 100)),
+                             'latency_ms': latency * 1000})
+
+        def log_message(self, format, *args):
+            pass  # one line per request would dominate the output
+
+    return Handler
+
+
+def serve(model_path, device='cpu', host='127.0.0.1', port=8765, max_batch=16, max_wait_ms=10):
+    server = PredictionServer(model_path, device, max_batch, max_wait_ms)
+    httpd = ThreadingHTTPServer((host, port), make_handler(server))
+    print(f"Serving IR drop predictions on http://{host}:{port}")
+    httpd.serve_forever()
+
+
+class IRDropClient(object):
+    def __init__(self, host='127.0.0.1', port=8765, timeout=60):
+        self.url = f'http://{host}:{port}'
+        self.timeout = timeout
+
+    def request(self, path, body=None):
+        data = json.dumps(body).encode() if body is not None else None
+        req = urllib.request.Request(self.url + path, data=data, headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(req, timeout=self.timeout) as response:
+            return json.loads(response.read())
+
+    def predict(self, design_path=None, features=None, preprocessed=False, threshold=0.1, top_k=100):
+        body = {'threshold': threshold, 'top_k': top_k}
+        if features is not None:
+            body['features'] = encode_array(features)
+            body['preprocessed'] = preprocessed
+        else:
+            body['design_path'] = design_path
+        result = self.request('/predict', body)
+        result['map'] = decode_array(result['map'])
+        return result
+
+    def stats(self):
+        return self.request('/stats')
+
+
+def parse_args():
+    description = "IR drop prediction server and client"
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("mode", choices=['serve', 'client'], help='Run the server, or send requests to it')
+    parser.add_argument("--host", default='127.0.0.1', type=str, help='Server address')
+    parser.add_argument("--port", default=8765, type=int, help='Server port')
+    parser.add_argument("--weight_path", default="./model_weight/irdrop_train_weights.pt", type=str, help='The path of the model weight')
+    parser.add_argument("--device", default='cpu', type=str, help='If you have GPU, type "cuda" for faster execution')
+    parser.add_argument("--max_batch", default=16, type=int, help='Most requests run in one forward pass')
+    parser.add_argument("--max_wait_ms", default=10, type=float, help='Longest wait for more requests after the first of a batch')
+    parser.add_argument("--design_path", default="./data/1", type=str, help='Client: the design folder to predict')
+    parser.add_argument("--n_requests", default=32, type=int, help='Client: requests sent')
+    parser.add_argument("--concurrency", default=8, type=int, help='Client: requests in flight at once')
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.mode == 'serve':
+        serve(args.weight_path, args.device, args.host, args.port, args.max_batch, args.max_wait_ms)
+    else:
+        # send n_requests concurrent requests for one design, then print the server latency stats
+        from concurrent.futures import ThreadPoolExecutor
+        client = IRDropClient(args.host, args.port)
+        with ThreadPoolExecutor(args.concurrency) as executor:
+            results = list(executor.map(lambda _: client.predict(args.design_path), range(args.n_requests)))
+        print(f"{len(results[0]['hotspots'])} hotspots, max IR drop {results[0]['map'].max():.4f}")
+        print(client.stats())
@@ -3,6 +3,7 @@ import torch
 import sys
 from IR_drop_model import IRdropModel
 from IR_drop_dataset import IRdropDataset
+from augmentation import BatchAugment
 from torch.utils.data import DataLoader
 from tqdm import tqdm
 import matplotlib.pyplot as plt
@@ -12,16 +13,30 @@ import torch.nn.functional as F
 
 device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
 
-def train(rootpath, batch_size, num_epochs, lr, fig_savepath, weight_savepath):
-    # Data loading
-    dataset = IRdropDataset(root_dir=rootpath, transform=True)
-    len_train_set = int(len(dataset) * 0.9)
-    len_test_set = len(dataset) - len_train_set
-    train_set, test_set = torch.utils.data.random_split(dataset, [len_train_set, len_test_set])
-    train_loader = DataLoader(dataset=train_set, batch_size=batch_size, shuffle=True, num_workers=8, pin_memory=True)
-    test_loader = DataLoader(dataset=test_set, batch_size=12, shuffle=True, num_workers=8, pin_memory=True)
-
-    model = IRdropModel(in_channel=26, device=device).to(device)
+def train(rootpath, batch_size, num_epochs, lr, fig_savepath, weight_savepath,
+          num_workers=8, persistent_workers=False, prefetch_factor=2, cache=False, augment='dihedral', seed=None,
+          split='random', split_file=None):
+    # Data loading; augment='sample' keeps the per-sample flips in the dataset, 'flip' / 'dihedral'
+    # transform whole batches on the device (see augmentation.py), 'none' disables augmentation
+    batch_augment = BatchAugment(rotations=augment == 'dihedral', seed=seed) if augment in ('flip', 'dihedral') else None
+    if split == 'family':
+        # train / val designs of split_file, or of the hashed design-family split (test is held out)
+        dataset = IRdropDataset(root_dir=rootpath, transform=augment == 'sample', cache=cache, split='train', split_file=split_file)
+        train_set = dataset
+        test_set = IRdropDataset(root_dir=rootpath, cache=cache, split='val', split_file=split_file)
+    else:
+        dataset = IRdropDataset(root_dir=rootpath, transform=augment == 'sample', cache=cache)
+        len_train_set = int(len(dataset) * 0.9)
+        len_test_set = len(dataset) - len_train_set
+        train_set, test_set = torch.utils.data.random_split(dataset, [len_train_set, len_test_set])
+    # persistent workers keep their process (and the page cache / shared cache they map) across epochs
+    loader_args = {'num_workers': num_workers, 'pin_memory': True}
+    if num_workers > 0:
+        loader_args.update(persistent_workers=persistent_workers, prefetch_factor=prefetch_factor)
+    train_loader = DataLoader(dataset=train_set, batch_size=batch_size, shuffle=True, **loader_args)
+    test_loader = DataLoader(dataset=test_set, batch_size=12, shuffle=True, **loader_args)
+
+    model = IRdropModel(in_channel=26).to(device)
 
     # Criterion
     ssim = SSIM(data_range=1, size_average=True, channel=1)
@@ -45,8 +60,10 @@ def train(rootpath, batch_size, num_epochs, lr, fig_savepath, weight_savepath):
         t = 0
         n1 = 0
         for batch_idx, (features, labels) in enumerate(tqdm(train_loader, desc=f'Epoch {e+1} Progress', leave=True, position=0)):
-            features = features.to(device=device)
-            labels = labels.to(device=device)
+            features = features.to(device=device).float()
+            labels = labels.to(device=device).float()
+            if batch_augment is not None:
+                features, labels = batch_augment(features, labels)
             
             # Forward
             with torch.cuda.amp.autocast():
@@ -71,8 +88,8 @@ def train(rootpath, batch_size, num_epochs, lr, fig_savepath, weight_savepath):
         v = 0
         n2 = 0
         for batch_idx, (features, labels) in enumerate(test_loader):
-            features = features.to(device=device)
-            labels = labels.to(device=device)
+            features = features.to(device=device).float()
+            labels = labels.to(device=device).float()
 
             with torch.cuda.amp.autocast():
                 pred = model(features)
@@ -84,6 +101,8 @@ def train(rootpath, batch_size, num_epochs, lr, fig_savepath, weight_savepath):
         valid_losses.append(v / n2)
 
         print(f"\nEpoch {e}: Train Loss: {t / n1:.4f} | Test Loss: {v / n2:.4f}")
+        io_stats = dataset.io_stats()
+        print(f"Epoch {e}: {io_stats['bytes_requested'] / 2**20:.1f} MiB requested, {io_stats['disk_read_bytes'] / 2**20:.1f} MiB read from disk")
         sys.stdout.flush()
 
         # Saving model if test loss improves
@@ -143,6 +162,14 @@ def parse_args():
     parser.add_argument("--weight_path", default="./model_weight", type=str, help='The path to save the model weight')
     parser.add_argument("--fig_path", default="./save_img", type=str, help='The path of the figure file')
     parser.add_argument("--learning_rate", default=0.0001, type=float, help='learning rate [0,1]')
+    parser.add_argument("--num_workers", default=8, type=int, help='DataLoader worker processes (0 loads in the main process)')
+    parser.add_argument("--persistent_workers", action='store_true', help='Keep the DataLoader workers alive across epochs')
+    parser.add_argument("--prefetch_factor", default=2, type=int, help='Batches prefetched by each worker')
+    parser.add_argument("--cache", action='store_true', help='Load the whole dataset once into shared memory')
+    parser.add_argument("--augment", default='dihedral', choices=['dihedral', 'flip', 'sample', 'none'], help='Batched dihedral / flip augmentation on the device, the old per-sample flips, or none')
+    parser.add_argument("--seed", default=None, type=int, help='Seed of the augmentation generator')
+    parser.add_argument("--split", default='random', choices=['random', 'family'], help='Random 90/10 split or train/val split by design family')
+    parser.add_argument("--split_file", default=None, type=str, help='JSON {"train": [...], "val": [...], "test": [...]} of design names for --split family')
     args = parser.parse_args()
     return args
 if __name__ == "__main__":
@@ -150,7 +177,10 @@ if __name__ == "__main__":
     start = time.time()
     args = parse_args()
     train(rootpath=args.root_path,batch_size=args.batch_size,num_epochs=args.num_epochs,lr=args.learning_rate,
-          fig_savepath=args.fig_path,weight_savepath=args.weight_path)
+          fig_savepath=args.fig_path,weight_savepath=args.weight_path,
+          num_workers=args.num_workers,persistent_workers=args.persistent_workers,
+          prefetch_factor=args.prefetch_factor,cache=args.cache,augment=args.augment,seed=args.seed,
+          split=args.split,split_file=args.split_file)
     end = time.time()
     print("training cost time：%f sec" % (end - start))
 
@@ -0,0 +1,49 @@
+import torch
+
+
+class BatchAugment(object):
+    # Random flips / dihedral transforms applied to a whole batch after it is on the device.
+    # Every sample draws one of the 8 elements of the dihedral group (4 rotations, each optionally
+    # mirrored); rotations=False limits that to the 4 flip combinations of the old per-sample hflip/vflip.
+    # Features and labels of a sample get the same transform. The draws come from a torch.Generator,
+    # so a seeded run is reproducible regardless of DataLoader workers.
+    def __init__(self, rotations=True, seed=None):
+        self.rotations = rotations
+        self.generator = torch.Generator()
+        if seed is not None:
+            self.generator.manual_seed(seed)
+        else:
+            self.generator.seed()
+
+    def __call__(self, features, labels):
+        batch = features.shape[0]
+        square = features.shape[-1] == features.shape[-2]
+        # transform t: mirror (left-right) if t & 1, then rotate by 90 degrees (t >> 1) times
+        n_transform = 8 if self.rotations and square else 4
+        transform = torch.randint(n_transform, (batch,), generator=self.generator).to(features.device)
+        if n_transform == 4:
+            # bit 0: hflip, bit 1: vflip; a vflip is a mirror followed by two rotations
+            transform = ((transform & 1) ^ (transform >> 1)) | ((transform >> 1) * 4)
+        features = features.clone()
+        labels = labels.clone()
+        for t in range(8):
+            idx = (transform == t).nonzero(as_tuple=True)[0]
+            if idx.numel() == 0 or t == 0:
+                continue
+            features[idx] = self.apply(features[idx], t)
+            labels[idx] = self.apply(labels[idx], t)
+        return features, labels
+
+    @staticmethod
+    def apply(x, t):
+        if t & 1:
+            x = torch.flip(x, dims=(-1,))
+        if t >> 1:
+            x = torch.rot90(x, t >> 1, dims=(-2, -1))
+        return x
+
+    def state_dict(self):
+        return {'generator': self.generator.get_state()}
+
+    def load_state_dict(self, state):
+        self.generator.set_state(state['generator'])
@@ -0,0 +1,66 @@
+import argparse
+import numpy as np
+
+
+# Assert-based equivalence checks of the optimized code paths against the code they replaced.
+# Run all of them with `python checks.py`, or some with `python checks.py resize_stack ...`.
+
+
+def check_resize_stack(shapes=((26, 300, 300), (26, 1000, 900), (26, 257, 256), (5, 300, 300), (26, 71, 71)), seed=0):
+    # preprocess() of a whole stack vs. the per-slice cv2.resize + std of the original IRDropPrediction,
+    # on grids above 256 that do not shrink by a whole-number factor (and one upscale)
+    import cv2
+    from preprocess import preprocess
+    rng = np.random.default_rng(seed)
+    for shape in shapes:
+        stack = rng.random(shape) * rng.integers(0, 2, shape[0])[:, None, None]  # some all-zero channels
+        legacy = []
+        for channel in stack:
+            resized = cv2.resize(channel, (256, 256), interpolation=cv2.INTER_AREA)
+            legacy.append(resized if resized.max() == 0 else (resized - resized.min()) / (resized.max() - resized.min()))
+        legacy = np.stack(legacy).astype(np.float32)
+        assert np.array_equal(preprocess(stack), legacy), f'preprocess differs from the per-slice resize on {shape}'
+        print(f"resize_stack: {shape} matches the per-slice resize")
+
+
+def check_fast_global(batch_sizes=(1, 2, 5), seed=0, atol=1e-5):
+    # Decoder.global_context (the fast_global default) vs. convT1 of the tiled global feature,
+    # on the decoder alone and through a whole IRdropModel sharing one set of weights
+    import torch
+    from IR_drop_model import Decoder, IRdropModel
+    torch.manual_seed(seed)
+    decoder = Decoder().eval()
+    for batch_size in batch_sizes:
+        r5 = torch.randn(batch_size, 256, 1, 1)
+        with torch.no_grad():
+            error = (decoder.convT1(decoder.tile16(r5)) - decoder.global_context(r5)).abs().max().item()
+        assert error <= atol, f'global_context differs from the tiled convT1 by {error:.2e} at batch size {batch_size}'
+        print(f"fast_global: decoder, batch size {batch_size}: max abs difference {error:.2e}")
+    fast = IRdropModel(in_channel=26, fast_global=True).eval()
+    legacy = IRdropModel(in_channel=26, fast_global=False).eval()
+    legacy.load_state_dict(fast.state_dict())
+    features = torch.rand(2, 26, 256, 256)
+    with torch.no_grad():
+        error = (fast(features) - legacy(features)).abs().max().item()
+    assert error <= atol, f'IRdropModel with fast_global differs by {error:.2e}'
+    print(f"fast_global: IRdropModel: max abs difference {error:.2e}")
+
+
+CHECKS = {'resize_stack': check_resize_stack, 'fast_global': check_fast_global}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Equivalence checks of the optimized code paths')
+    parser.add_argument('checks', nargs='*', help=f'checks to run, of {sorted(CHECKS)} (default: all)')
+    args = parser.parse_args()
+    unknown = set(args.checks) - set(CHECKS)
+    if unknown:
+        parser.error(f'unknown checks {sorted(unknown)}')
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    for name in args.checks or sorted(CHECKS):
+        CHECKS[name]()
+    print('all checks passed')
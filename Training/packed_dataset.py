@@ -0,0 +1,148 @@
+import os
+import json
+import argparse
+import numpy as np
+from preprocess import FEATURES, LABEL, design_features, design_label
+
+
+# Packed dataset: every design preprocessed to (26, 256, 256) features + (1, 256, 256) label,
+# stored in a few sharded .npy files plus index.json instead of one small file per feature map.
+#
+#   <root>/index.json           channels, size, dtype, design names in storage order, shard counts
+#   <root>/features_00000.npy   (n, 26, 256, 256) channels-first
+#   <root>/labels_00000.npy     (n, 1, 256, 256)
+#
+# Shards are opened with mmap_mode='r', so reading one design touches only its own pages.
+
+INDEX_NAME = 'index.json'
+
+
+def channel_names(features, n_time_window=20):
+    names = []
+    for feature_name in features:
+        if feature_name == 'power_t':
+            names.extend(f'power_t_{i}' for i in range(n_time_window))
+        else:
+            names.append(feature_name)
+    return names
+
+
+class PackedDatasetWriter(object):
+    def __init__(self, root, channels, size=256, dtype='float32', shard_size=64):
+        self.root = root
+        self.size = size
+        self.dtype = np.dtype(dtype)
+        self.shard_size = shard_size
+        self.index = {'version': 1, 'channels': channels, 'size': size, 'dtype': self.dtype.name,
+                      'designs': [], 'has_label': [], 'shards': []}
+        self.features = []
+        self.labels = []
+        if not os.path.exists(root):
+            os.makedirs(root)
+
+    def append(self, name, feature, label=None):
+        if feature.shape != (len(self.index['channels']), self.size, self.size):
+            raise ValueError(f'{name}: feature shape {feature.shape} does not match the dataset')
+        self.index['designs'].append(name)
+        self.index['has_label'].append(label is not None)
+        self.features.append(feature.astype(self.dtype))
+        self.labels.append(np.zeros((1, self.size, self.size), self.dtype) if label is None else label.astype(self.dtype))
+        if len(self.features) == self.shard_size:
+            self.flush()
+
+    def flush(self):
+        if not self.features:
+            return
+        shard = len(self.index['shards'])
+        np.save(os.path.join(self.root, f'features_{shard:05d}.npy'), np.stack(self.features))
+        np.save(os.path.join(self.root, f'labels_{shard:05d}.npy'), np.stack(self.labels))
+        self.index['shards'].append(len(self.features))
+        self.features = []
+        self.labels = []
+
+    def close(self):
+        self.flush()
+        index_path = os.path.join(self.root, INDEX_NAME)
+        with open(index_path + '.tmp', 'w') as f:
+            json.dump(self.index, f)
+        os.replace(index_path + '.tmp', index_path)
+
+
+class PackedDataset(object):
+    # mmap_mode='c' maps the shards copy-on-write, giving writable views (for torch.from_numpy)
+    # that still share the page cache and never copy unless written to
+    def __init__(self, root, mmap_mode='r'):
+        self.root = root
+        self.mmap_mode = mmap_mode
+        with open(os.path.join(root, INDEX_NAME), 'r') as f:
+            self.index = json.load(f)
+        self.names = self.index['designs']
+        self.channels = self.index['channels']
+        self.position = {name: i for i, name in enumerate(self.names)}
+        self.shard_start = np.concatenate([[0], np.cumsum(self.index['shards'])]).astype(np.int64)
+        self.shards = {}
+
+    def __len__(self):
+        return len(self.names)
+
+    def shard(self, kind, shard):
+        if (kind, shard) not in self.shards:
+            self.shards[kind, shard] = np.load(os.path.join(self.root, f'{kind}_{shard:05d}.npy'), mmap_mode=self.mmap_mode)
+        return self.shards[kind, shard]
+
+    def locate(self, index):
+        shard = int(np.searchsorted(self.shard_start, index, side='right')) - 1
+        return shard, index - int(self.shard_start[shard])
+
+    def feature(self, index):
+        shard, offset = self.locate(index)
+        return self.shard('features', shard)[offset]
+
+    def label(self, index):
+        shard, offset = self.locate(index)
+        return self.shard('labels', shard)[offset]
+
+    def has_label(self, index):
+        return self.index['has_label'][index]
+
+    def __getstate__(self):
+        # memmaps are reopened in every DataLoader worker rather than pickled
+        state = self.__dict__.copy()
+        state['shards'] = {}
+        return state
+
+
+def is_packed(path):
+    return os.path.isfile(os.path.join(path, INDEX_NAME))
+
+
+def design_arrays(design_path, features=FEATURES, size=256):
+    # preprocessed features and label (None without an IR_drop map) of one extracted design folder
+    label = design_label(design_path, size) if os.path.isdir(os.path.join(design_path, LABEL)) else None
+    return design_features(design_path, features, size), label
+
+
+def pack_designs(design_paths, root, features=FEATURES, size=256, dtype='float32', shard_size=64):
+    # design folders of feature_extraction output (one sub-folder per map) -> packed dataset at root
+    writer = PackedDatasetWriter(root, channel_names(features), size, dtype, shard_size)
+    for design_path in sorted(design_paths, key=os.path.basename):
+        writer.append(os.path.basename(design_path), *design_arrays(design_path, features, size))
+    writer.close()
+    return root
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Pack extracted feature maps into one sharded dataset')
+    parser.add_argument('--extracted_root', default='./data', type=str, help='parent dir of the extracted design folders')
+    parser.add_argument('--output_path', default='./packed', type=str, help='packed dataset dir')
+    parser.add_argument('--dtype', default='float32', type=str, help='float32 or float16')
+    parser.add_argument('--shard_size', default=64, type=int, help='designs per shard file')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    design_paths = [os.path.join(args.extracted_root, d) for d in os.listdir(args.extracted_root)
+                    if os.path.isdir(os.path.join(args.extracted_root, d))]
+    pack_designs(design_paths, args.output_path, dtype=args.dtype, shard_size=args.shard_size)
+    print(f'Packed {len(design_paths)} designs into {args.output_path}')
@@ -0,0 +1,55 @@
+import os
+import numpy as np
+import cv2
+
+
+# Preprocessing shared by the packed dataset builder and IRDropPrediction: every channel of a design
+# is area-resized to size x size and min-max normalized on its own. The (C, H, W) stack goes through
+# cv2.resize as channels-last chunks of up to 4 channels and one vectorized min/max, which gives
+# exactly the per-slice cv2.resize + std results the models were trained on.
+
+FEATURES = ['power_i', 'power_s', 'power_sca', 'power_all', 'power_t', 'VDD_Map', 'decap']
+LABEL = 'IR_drop'
+CV_MAX_CHANNELS = 4  # INTER_AREA handles more channels only for whole-number shrink factors
+
+
+def resize_stack(stack, size=256):
+    # (C, H, W) -> (C, size, size), INTER_AREA per channel
+    channels_last = np.ascontiguousarray(np.moveaxis(stack, 0, -1))
+    resized = []
+    for start in range(0, channels_last.shape[-1], CV_MAX_CHANNELS):
+        chunk = cv2.resize(channels_last[..., start:start + CV_MAX_CHANNELS], (size, size), interpolation=cv2.INTER_AREA)
+        resized.append(chunk.reshape(size, size, -1))
+    return np.moveaxis(np.concatenate(resized, axis=-1), -1, 0)
+
+
+def normalize_channels(stack):
+    # min-max normalization of every channel; channels whose maximum is 0 are left unchanged
+    low = stack.min(axis=(1, 2), keepdims=True)
+    high = stack.max(axis=(1, 2), keepdims=True)
+    keep = high == 0
+    return np.where(keep, stack, (stack - low) / np.where(keep, 1, high - low))
+
+
+def load_map(design_path, feature_name):
+    # the single .npy of one feature folder written by feature_extraction.save
+    feature_dir = os.path.join(design_path, feature_name)
+    return np.load(os.path.join(feature_dir, sorted(os.listdir(feature_dir))[0]))
+
+
+def stack_maps(maps):
+    # 2-D maps and (T, H, W) stacks (power_t) -> one (C, H, W) array
+    maps = [np.squeeze(m) for m in maps]
+    return np.concatenate([m.reshape((-1,) + m.shape[-2:]) for m in maps]).astype(np.float64)
+
+
+def preprocess(stack, size=256):
+    return normalize_channels(resize_stack(stack, size)).astype(np.float32)
+
+
+def design_features(design_path, features=FEATURES, size=256):
+    return preprocess(stack_maps([load_map(design_path, name) for name in features]), size)
+
+
+def design_label(design_path, size=256):
+    return preprocess(stack_maps([load_map(design_path, LABEL)]), size)
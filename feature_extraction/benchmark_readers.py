@@ -0,0 +1,133 @@
+import os
+import time
+import bisect
+import numpy as np
+import argparse
+import feature_extraction as fe
+from def_reader import read_route_def_columnar
+
+
+def best_of(repeat, func, *args):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def legacy_ir_time(gcell_index, ir_path):
+    # the per-line bisect loop get_IR used before reading the report in bulk
+    start = time.perf_counter()
+    ir_map = np.zeros(gcell_index['gcell_size'])
+    with open(ir_path, 'r') as read_file:
+        read = False
+        for line in read_file:
+            if line.startswith('Range'):
+                read = False
+            if read:
+                data = line.split()
+                if len(data) >= 5:
+                    ir_value = float(data[0])
+                    gcell_x = bisect.bisect_left(gcell_index['gcell_coordinate_x'], float(data[2]) * fe.unit_value)
+                    gcell_y = bisect.bisect_left(gcell_index['gcell_coordinate_y'], float(data[3]) * fe.unit_value)
+                    if ir_value > ir_map[gcell_x, gcell_y]:
+                        ir_map[gcell_x, gcell_y] = ir_value
+            if line.startswith('ir'):
+                read = True
+    return time.perf_counter() - start
+
+def legacy_read_power(power_path, lef_dict, tw_dict):
+    # read_power as it was before the eval() -> float() change, the reference for speed and values
+    power_dict = {}
+
+    with open(power_path, 'r') as read_file:
+        start = False
+        read = False
+        for line in read_file:
+            if "Instance" in line:
+                start = True
+            if start and line.startswith('Total'):
+                break
+            if start:
+                if line.startswith('-'):
+                    read = True
+                if read:
+                    if len(line.split()) == 1:
+                        name = line.split()[0].replace('\\', '')
+                    elif len(line.split()) == 8:
+                        if line.split()[-1] not in lef_dict or not lef_dict[line.split()[-1]]['type'] == 'std_cell':
+                            continue
+                        data = line.split()
+                        if eval(data[0]) == 0:
+                            if 'FILLER' in name:
+                                power_dict[name] = [0, float(data[2]), float(data[3]), float(data[4]), 'filler']
+                            else:
+                                power_dict[name] = [0, float(data[2]), float(data[3]), float(data[4]), tw_dict[name]]
+                        else:
+                            power_dict[name] = [eval(data[1])/eval(data[0]), float(data[2]), float(data[3]), float(data[4]), tw_dict[name]]
+                    elif len(line.split()) == 9:
+                        if line.split()[-1] not in lef_dict or not lef_dict[line.split()[-1]]['type'] == 'std_cell':
+                            continue
+                        data = line.split()
+                        name = data[0].replace('\\', '')
+                        if eval(data[1]) == 0:
+                            if 'FILLER' in name:
+                                power_dict[name] = [0, float(data[3]), float(data[4]), float(data[5]), 'filler']
+                            else:
+                                power_dict[name] = [0, float(data[3]), float(data[4]), float(data[5]), tw_dict[name]]
+                        else:
+                            power_dict[name] = [eval(data[2])/eval(data[1]), float(data[3]), float(data[4]), float(data[5]), tw_dict[name]]
+
+    return power_dict
+
+def check_power(legacy_dict, columnar, instance_names):
+    # the columnar power arrays hold the same instances and values as the eval() reader
+    assert len(legacy_dict) == len(columnar['instance']), 'power: instance count differs from the eval() reader'
+    for i, instance in enumerate(columnar['instance'].tolist()):
+        expected = legacy_dict[instance_names[instance]]
+        values = [columnar[key][i] for key in ('toggle', 'internal', 'switching', 'leakage')]
+        assert np.allclose(values, expected[:4], rtol=1e-12, atol=0), f'power: {instance_names[instance]} differs from the eval() reader'
+        assert columnar['filler'][i] == (expected[4] == 'filler'), f'power: {instance_names[instance]} filler flag differs'
+
+def report(name, legacy, columnar, size):
+    print('%-8s %10.3f s %10.3f s %8.1fx %10.1f MB/s' % (name, legacy, columnar, legacy / columnar, size / columnar / 1e6))
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--design_path", default = './data/ac97_ctrl', type=str, help = 'design folder with the DEF and reports')
+    parser.add_argument("--lef_path", default = './LEF/gsclib045_macro.lef', type=str, help = 'path to the LEF file')
+    parser.add_argument("--unit", default = 2000, type=int, help = 'unit defined in the beginning of DEF')
+    parser.add_argument("--n_time_window", default = 20, type=int, help = 'number of divided timing windows')
+    parser.add_argument("--repeat", default = 3, type=int, help = 'best of this many runs')
+    args = parser.parse_args()
+    return args
+
+if __name__ == '__main__':
+    args = parse_args()
+    fe.unit_value = args.unit
+    def_path = os.path.join(args.design_path, 'detailed_route.def.gz')
+    twf_path = os.path.join(args.design_path, 'cts.twf')
+    power_path = os.path.join(args.design_path, 'dyn_power.rpt')
+    lef_dict = fe.read_lef(args.lef_path, {}, args.unit)
+
+    print('%-8s %12s %12s %9s %15s' % ('reader', 'legacy', 'columnar', 'speedup', 'throughput'))
+    legacy, route = best_of(args.repeat, fe.read_route_def, def_path)
+    columnar, result = best_of(args.repeat, read_route_def_columnar, def_path)
+    report('DEF', legacy, columnar, os.path.getsize(def_path))
+
+    legacy, tw_dict = best_of(args.repeat, fe.read_twf, twf_path, route['route_net_dict'], args.n_time_window)
+    columnar, _ = best_of(args.repeat, fe.read_twf_columnar, twf_path, result, args.n_time_window)
+    report('TWF', legacy, columnar, os.path.getsize(twf_path))
+
+    # power: the legacy column is the original eval() reader (fe.read_power already uses float())
+    name_to_id = {name: i for i, name in enumerate(result['instance_names'])}
+    legacy, power_dict = best_of(args.repeat, legacy_read_power, power_path, lef_dict, tw_dict)
+    columnar, power = best_of(args.repeat, fe.read_power_columnar, power_path, lef_dict, name_to_id)
+    check_power(power_dict, power, result['instance_names'])
+    report('power', legacy, columnar, os.path.getsize(power_path))
+
+    ir_path = os.path.join(args.design_path, 'route_dynamic_ir.rpt')
+    gcell_index = fe.build_gcell_index(result, lef_dict)
+    columnar, _ = best_of(args.repeat, fe.get_IR, gcell_index, ir_path)
+    legacy = min(legacy_ir_time(gcell_index, ir_path) for _ in range(args.repeat))
+    report('IR', legacy, columnar, os.path.getsize(ir_path))
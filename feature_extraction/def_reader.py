@@ -0,0 +1,350 @@
+import numpy as np
+import os, gzip, re, mmap, shutil, subprocess, tempfile
+import concurrent.futures
+
+
+## Streaming DEF reader with a columnar output
+#
+# read_route_def_columnar returns the same gcell grid as feature_extraction.read_route_def, but
+# components come back as a NumPy structured array and nets as a CSR pin list. The file is read
+# in large blocks and everything outside COMPONENTS / PINS / NETS / GCELLGRID is skipped by
+# searching for the END of the section instead of looking at it line by line.
+
+ORIENTS = ('N', 'S', 'W', 'E', 'FN', 'FS', 'FW', 'FE')
+ROTATED_ORIENTS = np.array([False, False, True, True, False, False, True, True])  # W/E swap width and height
+
+ORIENT_ID = {o.encode(): i for i, o in enumerate(ORIENTS)}
+
+COMPONENT_DTYPE = np.dtype([('name', np.int64), ('master', np.int32), ('x', np.int64), ('y', np.int64), ('orient', np.int8)])
+
+SKIP_SECTIONS = (b'VIAS', b'SPECIALNETS', b'PROPERTYDEFINITIONS', b'NONDEFAULTRULES', b'BLOCKAGES', b'FILLS',
+                 b'REGIONS', b'GROUPS', b'STYLES', b'SCANCHAINS', b'SLOTS', b'PINPROPERTIES')
+
+COMPONENT_RE = re.compile(rb'^[ \t]*-[ \t]+(\S+)[ \t]+(\S+)[^\n]*?\b(?:PLACED|FIXED)[ \t]+\([ \t]*(-?\d+)[ \t]+(-?\d+)[ \t]*\)[ \t]*(\S+)', re.M)
+NET_LINE_RE = re.compile(rb'^[ \t]*(?:-[ \t]+(\S+)|(\([^\n]*))', re.M)
+NET_PIN_RE = re.compile(rb'(?<!\S)\([ \t]+(\S+)')
+SECTION_END_RE = {}
+
+
+def _section_end(section):
+    if section not in SECTION_END_RE:
+        SECTION_END_RE[section] = re.compile(rb'^[ \t]*END[ \t]+' + section + rb'\b', re.M)
+    return SECTION_END_RE[section]
+
+
+
+def iter_blocks(route_def_path, block_size=1 << 24):
+    # decompressed file content in blocks of about block_size bytes, always cut after a newline
+    with open(route_def_path, 'rb') as f:
+        gzipped = f.read(2) == b'\x1f\x8b'
+    read_file = gzip.open(route_def_path, 'rb') if gzipped else open(route_def_path, 'rb')
+    with read_file:
+        rest = b''
+        while True:
+            data = read_file.read(block_size)
+            if not data:
+                break
+            data = rest + data
+            cut = data.rfind(b'\n') + 1
+            if cut == 0:
+                rest = data
+                continue
+            rest = data[cut:]
+            yield data[:cut]
+        if rest:
+            yield rest + b'\n'
+
+
+
+def build_gcell_coordinates(GCELLX, GCELLY):
+    # gcell boundaries from the GCELLGRID statements, [at, do, step] each, in the order read_route_def uses
+    if len(GCELLX) <= 2:
+        raise ValueError("Invalid GCELL data")
+    GCELLX = list(GCELLX)
+    GCELLY = list(GCELLY)
+    if int(GCELLX[0][0]) < int(GCELLX[-1][0]):
+        GCELLX.reverse()
+        GCELLY.reverse()
+
+    coordinates = []
+    for grid in (GCELLY, GCELLX):
+        top = grid.pop()
+        coordinate = [top[0] + (i + 1) * top[2] for i in range(top[1] - 1)]
+        while grid:
+            top = grid.pop()
+            for _ in range(top[1]):
+                coordinate.append(coordinate[-1] + top[2])
+        coordinates.append(np.array(coordinate))
+    gcell_coordinate_y, gcell_coordinate_x = coordinates
+    return gcell_coordinate_x, gcell_coordinate_y
+
+
+
+def new_accumulator():
+    return {
+        'GCELLX': [],
+        'GCELLY': [],
+        'instance_names': [],
+        'master_names': [],
+        'master_id': {},
+        'comp_master': [],
+        'comp_x': [],
+        'comp_y': [],
+        'comp_orient': [],
+        'net_names': [],
+        'net_pin_count': [],
+        'pin_names': [],
+        'route_pin_dict': {},
+    }
+
+
+
+def parse_components(buf, start, stop, acc):
+    master_id = acc['master_id']
+    for m in COMPONENT_RE.finditer(buf, start, stop):
+        name, master, x, y, orient = m.groups()
+        acc['instance_names'].append(name.decode().replace('\\', ''))
+        if master not in master_id:
+            master_id[master] = len(acc['master_names'])
+            acc['master_names'].append(master.decode())
+        acc['comp_master'].append(master_id[master])
+        acc['comp_x'].append(int(x))
+        acc['comp_y'].append(int(y))
+        acc['comp_orient'].append(ORIENT_ID[orient])
+
+
+
+def parse_nets(buf, start, stop, acc):
+    # pin lines before the first '- net' of the range continue the last net already in acc
+    net_names = acc['net_names']
+    net_pin_count = acc['net_pin_count']
+    pin_names = acc['pin_names']
+    for m in NET_LINE_RE.finditer(buf, start, stop):
+        net, pins = m.groups()
+        if net is not None:
+            net_names.append(net.decode().replace('\\', ''))
+            net_pin_count.append(0)
+        elif net_names:
+            found = NET_PIN_RE.findall(pins)
+            net_pin_count[-1] += len(found)
+            pin_names.extend(found)
+
+
+
+def parse_pins(buf, start, stop, acc, pin=None):
+    route_pin_dict = acc['route_pin_dict']
+    for line in buf[start:stop].split(b'\n'):
+        line = line.strip()
+        if line.startswith(b'-'):
+            pin = line.split()[1].decode()
+        elif line.startswith(b'+ LAYER'):
+            pin_rect = re.findall(rb'\d+', line)
+            route_pin_dict[pin] = {}
+            route_pin_dict[pin]['layer'] = line.split()[2].decode()
+            route_pin_dict[pin]['rect'] = [int(pin_rect[-4]), int(pin_rect[-3]), int(pin_rect[-2]), int(pin_rect[-1])]
+        elif line.startswith(b'+ PLACED'):
+            data = line.split()
+            route_pin_dict[pin]['location'] = [int(data[3]), int(data[4])]
+            route_pin_dict[pin]['direction'] = data[6].decode()
+    return pin
+
+
+
+def read_blocks(blocks, acc):
+    section = None
+    pin = None
+    for block in blocks:
+        pos = 0
+        size = len(block)
+        while pos < size:
+            if section is not None:
+                end = _section_end(section).search(block, pos)
+                stop = end.start() if end else size
+                if section == b'COMPONENTS':
+                    parse_components(block, pos, stop, acc)
+                elif section == b'NETS':
+                    parse_nets(block, pos, stop, acc)
+                elif section == b'PINS':
+                    pin = parse_pins(block, pos, stop, acc, pin)
+                if end is None:
+                    pos = size
+                else:
+                    section = None
+                    pos = block.find(b'\n', end.end()) + 1 or size
+                continue
+
+            # header statements, one line at a time until the next section starts
+            eol = block.find(b'\n', pos) + 1 or size
+            line = block[pos:eol].strip()
+            pos = eol
+            keyword = line.split(None, 1)[0] if line else b''
+            if keyword == b'GCELLGRID':
+                data = line.split()
+                if len(data) == 8:
+                    gcell = [int(data[2]), int(data[4]), int(data[6])]  # at x do y step z
+                    if data[1] == b'Y':
+                        acc['GCELLY'].append(gcell)
+                    elif data[1] == b'X':
+                        acc['GCELLX'].append(gcell)
+            elif keyword in (b'COMPONENTS', b'NETS', b'PINS') or keyword in SKIP_SECTIONS:
+                section = keyword
+    return acc
+
+
+
+def finish(acc):
+    GCELLX = acc['GCELLX']
+    GCELLY = acc['GCELLY']
+    gcell_coordinate_x, gcell_coordinate_y = build_gcell_coordinates(GCELLX, GCELLY)
+    gcell_size = [sum(g[1] for g in GCELLX) - 1, sum(g[1] for g in GCELLY) - 1]
+
+    instance_names = acc['instance_names']
+    components = np.empty(len(instance_names), dtype=COMPONENT_DTYPE)
+    components['name'] = np.arange(len(instance_names))
+    components['master'] = acc['comp_master']
+    components['x'] = acc['comp_x']
+    components['y'] = acc['comp_y']
+    components['orient'] = acc['comp_orient']
+
+    # pins that do not name a component (e.g. '( PIN clk )') are kept as -1
+    pin_names = acc['pin_names']
+    name_to_id = {name: i for i, name in enumerate(instance_names)}
+    net_pin_instance = np.fromiter((name_to_id.get(p.decode().replace('\\', ''), -1) for p in pin_names),
+                                   dtype=np.int64, count=len(pin_names))
+    net_pin_ptr = np.zeros(len(acc['net_names']) + 1, dtype=np.int64)
+    np.cumsum(acc['net_pin_count'], out=net_pin_ptr[1:])
+
+    return {
+        'gcell_size': gcell_size,
+        'gcell_coordinate_x': gcell_coordinate_x,
+        'gcell_coordinate_y': gcell_coordinate_y,
+        'instance_names': instance_names,
+        'master_names': acc['master_names'],
+        'components': components,
+        'net_names': acc['net_names'],
+        'net_pin_ptr': net_pin_ptr,
+        'net_pin_instance': net_pin_instance,
+        'route_pin_dict': acc['route_pin_dict']
+    }
+
+
+
+def read_route_def_columnar(route_def_path, block_size=1 << 24, n_workers=1, tmp_dir=None):
+    if n_workers > 1:
+        return read_route_def_parallel(route_def_path, n_workers, tmp_dir)
+    return finish(read_blocks(iter_blocks(route_def_path, block_size), new_accumulator()))
+
+
+
+
+## Multi-process DEF parsing
+#
+# The DEF is decompressed once into a temporary file (with pigz when it is installed) and
+# memory-mapped. COMPONENTS and NETS are cut into byte ranges at '- ' statement starts, so that
+# no component or net is split, and the ranges are parsed by worker processes and merged in order.
+# Everything else (header, GCELLGRID, PINS) is small and read in the main process.
+
+def decompress_to_temp(route_def_path, tmp_dir=None):
+    # returns (path of the plain DEF, True if it is a temporary file the caller must delete)
+    with open(route_def_path, 'rb') as f:
+        if f.read(2) != b'\x1f\x8b':
+            return route_def_path, False
+    fd, tmp_path = tempfile.mkstemp(suffix='.def', dir=tmp_dir)
+    with os.fdopen(fd, 'wb') as out:
+        if shutil.which('pigz'):
+            subprocess.run(['pigz', '-dc', route_def_path], stdout=out, check=True)
+        else:
+            with gzip.open(route_def_path, 'rb') as read_file:
+                shutil.copyfileobj(read_file, out, 1 << 24)
+    return tmp_path, True
+
+
+
+def split_range(buf, start, stop, n):
+    # up to n [start, stop) ranges, each cut right before a line starting with '-'
+    bounds = [start]
+    for i in range(1, n):
+        cut = buf.find(b'\n-', max(bounds[-1], start + (stop - start) * i // n), stop)
+        if cut < 0:
+            break
+        bounds.append(cut + 1)
+    bounds.append(stop)
+    return [(a, b) for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+
+
+
+def parse_range(def_path, section, start, stop):
+    acc = new_accumulator()
+    with open(def_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        if section == b'COMPONENTS':
+            parse_components(buf, start, stop, acc)
+        else:
+            parse_nets(buf, start, stop, acc)
+    del acc['master_id']
+    return acc
+
+
+
+def merge_accumulator(acc, part):
+    # append a worker result, remapping its master ids onto acc's master table
+    remap = []
+    for name in part['master_names']:
+        key = name.encode()
+        if key not in acc['master_id']:
+            acc['master_id'][key] = len(acc['master_names'])
+            acc['master_names'].append(name)
+        remap.append(acc['master_id'][key])
+    acc['comp_master'].extend(remap[m] for m in part['comp_master'])
+    for key in ('instance_names', 'comp_x', 'comp_y', 'comp_orient', 'net_names', 'net_pin_count', 'pin_names'):
+        acc[key].extend(part[key])
+
+
+
+def read_route_def_parallel(route_def_path, n_workers, tmp_dir=None):
+    def_path, is_temp = decompress_to_temp(route_def_path, tmp_dir)
+    try:
+        with open(def_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            # body byte range of COMPONENTS and NETS (between the section line and its END line)
+            bodies = {}
+            for section in (b'COMPONENTS', b'NETS'):
+                begin = re.compile(rb'^' + section + rb'\b', re.M).search(buf)
+                if begin is None:
+                    continue
+                body_start = buf.find(b'\n', begin.end()) + 1
+                end = _section_end(section).search(buf, body_start)
+                bodies[section] = (body_start, end.start() if end else len(buf))
+
+            jobs = []
+            for section, (start, stop) in bodies.items():
+                jobs.extend((section, a, b) for a, b in split_range(buf, start, stop, n_workers * 4))
+
+            with concurrent.futures.ProcessPoolExecutor(max_workers=n_workers) as executor:
+                futures = [executor.submit(parse_range, def_path, section, a, b) for section, a, b in jobs]
+
+                # everything outside the two bodies, read by the serial state machine meanwhile
+                acc = new_accumulator()
+                cuts = sorted(bodies.values())
+                pos = 0
+                rest = []
+                for start, stop in cuts:
+                    rest.append(buf[pos:start])
+                    pos = stop
+                rest.append(buf[pos:])
+                read_blocks(rest, acc)
+
+                for future in futures:
+                    merge_accumulator(acc, future.result())
+    finally:
+        if is_temp:
+            os.remove(def_path)
+    return finish(acc)
+
+
+
+
+def route_net_dict_view(columnar):
+    # net -> [instance names] in the shape of read_route_def's route_net_dict (IO pins appear as 'PIN')
+    names = columnar['instance_names']
+    ptr = columnar['net_pin_ptr']
+    pins = [names[i] if i >= 0 else 'PIN' for i in columnar['net_pin_instance'].tolist()]
+    return {net: pins[ptr[i]:ptr[i + 1]] for i, net in enumerate(columnar['net_names'])}
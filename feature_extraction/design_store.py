@@ -0,0 +1,107 @@
+import numpy as np
+import os, shutil, tempfile
+
+from def_reader import ORIENTS
+
+
+## Memory-mapped columnar store of a parsed design
+#
+# save_design writes the columnar DEF (def_reader.read_route_def_columnar) together with its gcell
+# index (feature_extraction.build_gcell_index) as one .npy per array plus string tables (utf-8 blob +
+# offsets) into a directory, by default on /dev/shm. load_design maps it back read-only, so any number
+# of processes can build maps from the same parsed design without pickling or re-parsing it; the
+# pages are shared through the page cache and strings are only decoded by the stages that need them.
+
+ARRAYS = ('gcell_size', 'gcell_coordinate_x', 'gcell_coordinate_y', 'rects', 'span', 'row', 'gcell', 'overlap',
+          'net_pin_ptr', 'net_pin_instance', 'master', 'orient')
+STRINGS = ('instance_names', 'master_names', 'net_names')
+
+
+def default_store_dir():
+    return '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+
+def save_strings(path, key, strings):
+    encoded = [s.encode() for s in strings]
+    ptr = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(s) for s in encoded], out=ptr[1:])
+    np.save(os.path.join(path, f'{key}.ptr.npy'), ptr)
+    np.save(os.path.join(path, f'{key}.str.npy'), np.frombuffer(b''.join(encoded), dtype=np.uint8))
+
+
+class StringTable(object):
+    # read-only list of strings backed by a utf-8 blob and an offsets array
+    def __init__(self, path, key):
+        self.ptr = np.load(os.path.join(path, f'{key}.ptr.npy'), mmap_mode='r')
+        self.blob = np.load(os.path.join(path, f'{key}.str.npy'), mmap_mode='r')
+        self._list = None
+
+    def __len__(self):
+        return len(self.ptr) - 1
+
+    def __getitem__(self, i):
+        if self._list is not None:
+            return self._list[i]
+        return bytes(self.blob[self.ptr[i]:self.ptr[i + 1]]).decode()
+
+    def __iter__(self):
+        return iter(self.tolist())
+
+    def tolist(self):
+        if self._list is None:
+            blob = bytes(self.blob)
+            ptr = self.ptr.tolist()
+            self._list = [blob[ptr[i]:ptr[i + 1]].decode() for i in range(len(ptr) - 1)]
+        return self._list
+
+
+class DesignView(dict):
+    # the loaded arrays, plus the gcell_index / route_result keys derived from them on first access
+    def __missing__(self, key):
+        if key == 'names':
+            value = self['instance_names']
+        elif key == 'name_to_id':
+            value = {name: i for i, name in enumerate(self['instance_names'])}
+        elif key == 'cell_names':
+            master_names = self['master_names'].tolist()
+            value = [master_names[m] for m in self['master'].tolist()]
+        elif key == 'orients':
+            value = [ORIENTS[o] for o in self['orient'].tolist()]
+        else:
+            raise KeyError(key)
+        self[key] = value
+        return value
+
+
+def save_design(route_result, gcell_index, store_dir=None):
+    # returns the path of a new store directory; remove it with drop_design when done
+    path = tempfile.mkdtemp(prefix='design_', dir=store_dir or default_store_dir())
+    arrays = {
+        'gcell_size': np.asarray(gcell_index['gcell_size'], dtype=np.int64),
+        'master': route_result['components']['master'],
+        'orient': route_result['components']['orient'],
+        'net_pin_ptr': route_result['net_pin_ptr'],
+        'net_pin_instance': route_result['net_pin_instance'],
+    }
+    for key in ARRAYS:
+        if key not in arrays:
+            arrays[key] = gcell_index[key]
+    for key, value in arrays.items():
+        np.save(os.path.join(path, f'{key}.npy'), np.ascontiguousarray(value))
+    for key in STRINGS:
+        save_strings(path, key, route_result[key])
+    return path
+
+
+def load_design(path):
+    design = DesignView()
+    for key in ARRAYS:
+        design[key] = np.load(os.path.join(path, f'{key}.npy'), mmap_mode='r')
+    design['gcell_size'] = design['gcell_size'].tolist()
+    for key in STRINGS:
+        design[key] = StringTable(path, key)
+    return design
+
+
+def drop_design(path):
+    shutil.rmtree(path, ignore_errors=True)
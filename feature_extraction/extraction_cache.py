@@ -0,0 +1,94 @@
+import os
+import json
+import hashlib
+
+
+## Incremental extraction: a manifest.json per design output folder
+#
+# For every saved feature map the manifest records the hashes of the inputs it was built from.
+# A map is regenerated only when its file is missing or one of those hashes changed. File hashes
+# are content hashes (sha256); they are reused from the manifest while size and mtime of the file
+# are unchanged, so an up-to-date design costs a few stat() calls instead of re-reading its reports.
+
+MANIFEST_NAME = 'manifest.json'
+
+# inputs of every output map, as keys of the inputs dict passed to input_hashes
+MAP_INPUTS = {
+    'power_t': ('def', 'lef', 'twf', 'power', 'unit', 'n_time_window'),
+    'power_i': ('def', 'lef', 'twf', 'power', 'unit', 'n_time_window'),
+    'power_s': ('def', 'lef', 'twf', 'power', 'unit', 'n_time_window'),
+    'power_sca': ('def', 'lef', 'twf', 'power', 'unit', 'n_time_window'),
+    'power_all': ('def', 'lef', 'twf', 'power', 'unit', 'n_time_window'),
+    'decap': ('def', 'lef', 'unit'),
+    'VDD_Map': ('def', 'lef', 'pp', 'unit'),
+    'IR_drop': ('def', 'lef', 'ir', 'unit'),
+}
+
+
+def file_digest(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_manifest(output_path):
+    manifest_path = os.path.join(output_path, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return {'files': {}, 'maps': {}}
+    with open(manifest_path, 'r') as f:
+        return json.load(f)
+
+
+def save_manifest(output_path, manifest):
+    manifest_path = os.path.join(output_path, MANIFEST_NAME)
+    tmp_path = f'{manifest_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+def cached_digest(path, manifest):
+    # content hash of one file, reused from manifest['files'] while size and mtime match
+    stat = os.stat(path)
+    key = os.path.abspath(path)
+    entry = manifest['files'].get(key)
+    if entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+        return entry['sha256']
+    digest = file_digest(path)
+    manifest['files'][key] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': digest}
+    return digest
+
+
+def input_hashes(inputs, manifest):
+    # inputs: name -> file path, list of file paths (hashed together, order-independent) or a plain value
+    hashes = {}
+    for name, value in inputs.items():
+        if isinstance(value, (list, tuple)):
+            digest = hashlib.sha256()
+            for path in sorted(value):
+                digest.update(os.path.basename(path).encode())
+                digest.update(cached_digest(path, manifest).encode())
+            hashes[name] = digest.hexdigest()
+        elif isinstance(value, str) and os.path.isfile(value):
+            hashes[name] = cached_digest(value, manifest)
+        else:
+            hashes[name] = hashlib.sha256(repr(value).encode()).hexdigest()
+    return hashes
+
+
+def stale_maps(output_path, manifest, hashes, map_files):
+    # names of the maps (keys of map_files: name -> path relative to output_path) to regenerate
+    stale = set()
+    for name, rel_path in map_files.items():
+        entry = manifest['maps'].get(name)
+        expected = {key: hashes[key] for key in MAP_INPUTS[name]}
+        if entry is None or entry['inputs'] != expected or not os.path.exists(os.path.join(output_path, rel_path)):
+            stale.add(name)
+    return stale
+
+
+def record_map(output_path, manifest, hashes, name, rel_path):
+    manifest['maps'][name] = {'file': rel_path, 'inputs': {key: hashes[key] for key in MAP_INPUTS[name]}}
+    save_manifest(output_path, manifest)
@@ -1,7 +1,12 @@
 import numpy as np
-import os, re, bisect, gzip, csv, math, binascii
+import os, io, re, bisect, gzip, csv, math, binascii, pickle, hashlib
 import glob
 import concurrent.futures
+import time
+from scipy.spatial import cKDTree
+import extraction_cache
+import design_store
+from def_reader import read_route_def_columnar, iter_blocks, ORIENTS, ROTATED_ORIENTS
 
 
 def instance_direction_rect(line): # used when we only need bounding box (rect) of the cell.
@@ -106,67 +111,72 @@ def polygon_to_bounding_rectangle(polygon):
 
 def read_lef(path, lef_dict, unit):
     with open(path, 'r') as read_file:
-        cell_name = ''
-        pin_name = ''
-        polygons = []
-        rect_list_left = []
-        rect_list_lower = []
-        rect_list_right = []
-        rect_list_upper = []
-        READ_MACRO = False
-        for line in read_file:
-            if line.lstrip().startswith('MACRO'):
-                READ_MACRO = True
-                cell_name = line.split()[1]
-                lef_dict[cell_name] = {}
-                lef_dict[cell_name]['pin'] = {}
-                lef_dict[cell_name]['type'] = 'std_cell'
-
-            if READ_MACRO:
-                if line.lstrip().startswith('SIZE'):
-                    l = re.findall(r'-?\d+\.?\d*e?-?\d*?', line)
-                    lef_dict[cell_name]['size'] = [unit * float(l[0]), unit * float(l[1])]  # size [unit*w,unit*h]
-
-                elif line.lstrip().startswith('PIN'):
-                    pin_name = line.split()[1]
-                    polygons = []
-                    rect_list_left = []
-                    rect_list_lower = []
-                    rect_list_right = []
-                    rect_list_upper = []
-
-                elif line.lstrip().startswith('RECT'):
-                    l = re.findall(r'-?\d+\.?\d*e?-?\d*?', line)
-                    rect_left = float(l[0]) * unit
-                    rect_lower = float(l[1]) * unit
-                    rect_right = float(l[2]) * unit
-                    rect_upper = float(l[3]) * unit
-                    rect_list_left.append(rect_left)
-                    rect_list_lower.append(rect_lower)
-                    rect_list_right.append(rect_right)
-                    rect_list_upper.append(rect_upper)
-
-                elif line.lstrip().startswith('POLYGON'):
-                    l = re.findall(r'-?\d+\.?\d*e?-?\d*?', line)
-                    polygon = [unit * float(coord) for coord in l]
-                    polygons.append(polygon)
-
-                elif line.lstrip().startswith(f'END {pin_name}'):
-                    if rect_list_left and rect_list_lower and rect_list_right and rect_list_upper:
-                        rect_left = min(rect_list_left)
-                        rect_lower = min(rect_list_lower)
-                        rect_right = max(rect_list_right)
-                        rect_upper = max(rect_list_upper)
-                        lef_dict[cell_name]['pin'][pin_name] = [rect_left, rect_lower, rect_right, rect_upper]  # pin_rect
-                    elif polygons:
-                        for polygon in polygons:
-                            bounding_rect = polygon_to_bounding_rectangle(polygon)
-                            lef_dict[cell_name]['pin'][pin_name] = bounding_rect
-                    rect_list_left = []
-                    rect_list_lower = []
-                    rect_list_right = []
-                    rect_list_upper = []
-                    polygons = []
+        return read_lef_lines(read_file, lef_dict, unit)
+
+
+
+def read_lef_lines(lines, lef_dict, unit):
+    cell_name = ''
+    pin_name = ''
+    polygons = []
+    rect_list_left = []
+    rect_list_lower = []
+    rect_list_right = []
+    rect_list_upper = []
+    READ_MACRO = False
+    for line in lines:
+        if line.lstrip().startswith('MACRO'):
+            READ_MACRO = True
+            cell_name = line.split()[1]
+            lef_dict[cell_name] = {}
+            lef_dict[cell_name]['pin'] = {}
+            lef_dict[cell_name]['type'] = 'std_cell'
+
+        if READ_MACRO:
+            if line.lstrip().startswith('SIZE'):
+                l = re.findall(r'-?\d+\.?\d*e?-?\d*?', line)
+                lef_dict[cell_name]['size'] = [unit * float(l[0]), unit * float(l[1])]  # size [unit*w,unit*h]
+
+            elif line.lstrip().startswith('PIN'):
+                pin_name = line.split()[1]
+                polygons = []
+                rect_list_left = []
+                rect_list_lower = []
+                rect_list_right = []
+                rect_list_upper = []
+
+            elif line.lstrip().startswith('RECT'):
+                l = re.findall(r'-?\d+\.?\d*e?-?\d*?', line)
+                rect_left = float(l[0]) * unit
+                rect_lower = float(l[1]) * unit
+                rect_right = float(l[2]) * unit
+                rect_upper = float(l[3]) * unit
+                rect_list_left.append(rect_left)
+                rect_list_lower.append(rect_lower)
+                rect_list_right.append(rect_right)
+                rect_list_upper.append(rect_upper)
+
+            elif line.lstrip().startswith('POLYGON'):
+                l = re.findall(r'-?\d+\.?\d*e?-?\d*?', line)
+                polygon = [unit * float(coord) for coord in l]
+                polygons.append(polygon)
+
+            elif line.lstrip().startswith(f'END {pin_name}'):
+                if rect_list_left and rect_list_lower and rect_list_right and rect_list_upper:
+                    rect_left = min(rect_list_left)
+                    rect_lower = min(rect_list_lower)
+                    rect_right = max(rect_list_right)
+                    rect_upper = max(rect_list_upper)
+                    lef_dict[cell_name]['pin'][pin_name] = [rect_left, rect_lower, rect_right, rect_upper]  # pin_rect
+                elif polygons:
+                    for polygon in polygons:
+                        bounding_rect = polygon_to_bounding_rectangle(polygon)
+                        lef_dict[cell_name]['pin'][pin_name] = bounding_rect
+                rect_list_left = []
+                rect_list_lower = []
+                rect_list_right = []
+                rect_list_upper = []
+                polygons = []
 
     return lef_dict
 
@@ -177,37 +187,42 @@ def read_lef(path, lef_dict, unit):
 
 def read_lef_pin_map(path, lef_dic, unit):
     with open(path, 'r') as read_file:
-        cell_name = ''
-        pin_name = ''
-        READ_MACRO = False
+        return read_lef_pin_map_lines(read_file, lef_dic, unit)
 
-        for line in read_file:
-            if line.lstrip().startswith('MACRO'):
-                cell_name = line.split()[1]
-                lef_dic[cell_name] = {}
-                lef_dic[cell_name]['pin'] = {}
-                READ_MACRO = True
 
-            if READ_MACRO:
 
-                if line.lstrip().startswith('SIZE'):
-                    l = re.findall(r'-?\d+\.?\d*e?-?\d*?', line)
-                    lef_dic[cell_name]['size'] = [unit * float(l[0]), unit * float(l[1])]
+def read_lef_pin_map_lines(lines, lef_dic, unit):
+    cell_name = ''
+    pin_name = ''
+    READ_MACRO = False
 
-                elif line.lstrip().startswith('PIN') or line.lstrip().startswith('OBS'):
-                    if line.lstrip().startswith('OBS'):
-                        pin_name = 'OBS'
-                    else:
-                        pin_name = line.split()[1]
-                    lef_dic[cell_name]['pin'][pin_name] = {}
+    for line in lines:
+        if line.lstrip().startswith('MACRO'):
+            cell_name = line.split()[1]
+            lef_dic[cell_name] = {}
+            lef_dic[cell_name]['pin'] = {}
+            READ_MACRO = True
 
-                elif line.lstrip().startswith('LAYER'):
-                    pin_layer = line.split()[1]
-                    lef_dic[cell_name]['pin'][pin_name][pin_layer] = []
+        if READ_MACRO:
 
-                elif line.lstrip().startswith('RECT'):
-                    l = line.split()
-                    lef_dic[cell_name]['pin'][pin_name][pin_layer].append([float(l[1])* unit,float(l[2])* unit,float(l[3])* unit,float(l[4])* unit])
+            if line.lstrip().startswith('SIZE'):
+                l = re.findall(r'-?\d+\.?\d*e?-?\d*?', line)
+                lef_dic[cell_name]['size'] = [unit * float(l[0]), unit * float(l[1])]
+
+            elif line.lstrip().startswith('PIN') or line.lstrip().startswith('OBS'):
+                if line.lstrip().startswith('OBS'):
+                    pin_name = 'OBS'
+                else:
+                    pin_name = line.split()[1]
+                lef_dic[cell_name]['pin'][pin_name] = {}
+
+            elif line.lstrip().startswith('LAYER'):
+                pin_layer = line.split()[1]
+                lef_dic[cell_name]['pin'][pin_name][pin_layer] = []
+
+            elif line.lstrip().startswith('RECT'):
+                l = line.split()
+                lef_dic[cell_name]['pin'][pin_name][pin_layer].append([float(l[1])* unit,float(l[2])* unit,float(l[3])* unit,float(l[4])* unit])
 
     return lef_dic
 
@@ -218,6 +233,68 @@ def read_lef_pin_map(path, lef_dic, unit):
 
 
 
+class LefLibrary(object):
+    # Both LEF views (read_lef bounding boxes and read_lef_pin_map per-layer rects) from a single
+    # parse, cached on disk as a pickle keyed by LEF path + mtime + size + unit.
+    def __init__(self, path, unit, lef_dict, pin_map):
+        self.path = path
+        self.unit = unit
+        self.lef_dict = lef_dict
+        self.pin_map = pin_map
+
+    @classmethod
+    def parse(cls, path, unit):
+        with open(path, 'r') as read_file:
+            lines = read_file.readlines()
+        return cls(path, unit, read_lef_lines(lines, {}, unit), read_lef_pin_map_lines(lines, {}, unit))
+
+    @staticmethod
+    def cache_path(path, unit, cache_dir=None):
+        stat = os.stat(path)
+        key = f'{os.path.abspath(path)}|{stat.st_mtime_ns}|{stat.st_size}|{unit}'
+        name = f'{os.path.basename(path)}.{hashlib.sha1(key.encode()).hexdigest()[:16]}.pkl'
+        if cache_dir is None:
+            cache_dir = os.path.join(os.path.dirname(os.path.abspath(path)), '.lef_cache')
+        return os.path.join(cache_dir, name)
+
+    @classmethod
+    def load(cls, path, unit, cache_dir=None):
+        cache_file = cls.cache_path(path, unit, cache_dir)
+        if os.path.exists(cache_file):
+            with open(cache_file, 'rb') as f:
+                lef_dict, pin_map = pickle.load(f)
+            return cls(path, unit, lef_dict, pin_map)
+
+        library = cls.parse(path, unit)
+        try:
+            os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+            tmp_file = f'{cache_file}.{os.getpid()}.tmp'
+            with open(tmp_file, 'wb') as f:
+                pickle.dump((library.lef_dict, library.pin_map), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_file, cache_file)  # atomic, several workers may race on the first run
+        except OSError as e:
+            print(f"LEF cache not written ({cache_file}): {e}")
+        return library
+
+
+
+_lef_libraries = {}
+
+def get_lef_library(path, unit, cache_dir=None):
+    # one LefLibrary per (path, unit) and process; loaded in the parent before forking workers,
+    # the children share it copy-on-write instead of reading the cache again
+    key = (os.path.abspath(path), unit)
+    if key not in _lef_libraries:
+        _lef_libraries[key] = LefLibrary.load(path, unit, cache_dir)
+    return _lef_libraries[key]
+
+
+
+
+
+
+
+
 ## DEF file reading and processing functions
 
 def read_route_def(route_def_path):
@@ -344,6 +421,97 @@ def read_route_def(route_def_path):
 
 
 
+## Instance-to-gcell index, built once per design and shared by every map builder
+
+def master_size(lef_dict, master):
+    # [w, h] of a LEF macro; masters missing from the LEF (hard macros, IO cells) get zero size,
+    # so they stay in the index but add nothing to any gcell
+    cell = lef_dict.get(master)
+    return cell['size'] if cell is not None and 'size' in cell else [0.0, 0.0]
+
+
+
+def get_component_rects(components, master_names, lef_dict):
+    # get_instance_rects for the structured component array of def_reader.read_route_def_columnar
+    sizes = np.array([master_size(lef_dict, name) for name in master_names], dtype=np.float64).reshape(-1, 2)
+    size = sizes[components['master']]
+    rotated = ROTATED_ORIENTS[components['orient']]
+    width = np.where(rotated, size[:, 1], size[:, 0])
+    height = np.where(rotated, size[:, 0], size[:, 1])
+    x = components['x'].astype(np.float64)
+    y = components['y'].astype(np.float64)
+    return np.column_stack([x, y, x + width, y + height])
+
+
+
+def build_gcell_index(route_result, lef_dict):
+    # accepts either read_route_def (dicts) or def_reader.read_route_def_columnar output
+    gcell_coordinate_x = route_result['gcell_coordinate_x']
+    gcell_coordinate_y = route_result['gcell_coordinate_y']
+
+    if 'components' in route_result:
+        components = route_result['components']
+        master_names = route_result['master_names']
+        names = route_result['instance_names']
+        cell_names = [master_names[m] for m in components['master'].tolist()]
+        orients = [ORIENTS[o] for o in components['orient'].tolist()]
+        rects = get_component_rects(components, master_names, lef_dict)
+    else:
+        route_instance_dict = route_result['route_instance_dict']
+        names = list(route_instance_dict)
+        cell_names = [route_instance_dict[name][0] for name in names]
+        orients = [route_instance_dict[name][2] for name in names]
+        rects = get_instance_rects(names, route_instance_dict, lef_dict)
+    unknown_masters = {}
+    for cell_name in cell_names:
+        if 'size' not in lef_dict.get(cell_name, {}):
+            unknown_masters[cell_name] = unknown_masters.get(cell_name, 0) + 1
+    if unknown_masters:
+        print(f"{sum(unknown_masters.values())} instances of {len(unknown_masters)} masters missing from the LEF are skipped: "
+              f"{sorted(unknown_masters)}")
+    span = get_gcell_span(rects, gcell_coordinate_x, gcell_coordinate_y)
+    row, gcell, overlap = rasterize_instances(rects, gcell_coordinate_x, gcell_coordinate_y, span)
+
+    return {
+        'gcell_size': route_result['gcell_size'],
+        'gcell_coordinate_x': gcell_coordinate_x,
+        'gcell_coordinate_y': gcell_coordinate_y,
+        'names': names,
+        'name_to_id': {name: i for i, name in enumerate(names)},
+        'cell_names': cell_names,
+        'orients': orients,
+        'rects': rects,      # (n, 4) x_left, y_lower, x_right, y_upper
+        'span': span,        # (n, 4) bisect_left gcell index of each rect edge
+        'row': row,          # COO instance -> gcell overlap matrix
+        'gcell': gcell,
+        'overlap': overlap,
+        'unknown_masters': unknown_masters,  # master -> instances skipped (zero size)
+    }
+
+
+
+def instance_ids(gcell_index, instance_names):
+    name_to_id = gcell_index['name_to_id']
+    return np.fromiter((name_to_id[name] for name in instance_names), dtype=np.int64, count=len(instance_names))
+
+
+
+def index_to_gcell(gcell_index, weight):
+    # per-instance weight (indexed like gcell_index['names']) rasterized onto the gcell grid
+    return scatter_to_gcell(gcell_index['row'], gcell_index['gcell'], gcell_index['overlap'], weight, gcell_index['gcell_size'])
+
+
+
+def locate_gcell(gcell_index, x, y):
+    # bisect_left gcell index of arbitrary points on the index grid
+    return (np.searchsorted(gcell_index['gcell_coordinate_x'], x, side='left'),
+            np.searchsorted(gcell_index['gcell_coordinate_y'], y, side='left'))
+
+
+
+
+
+
 ## Functions related to power and time-window calculations
 
 def read_twf(twf_path, route_net_dict, n_time_window):
@@ -405,6 +573,69 @@ def read_twf(twf_path, route_net_dict, n_time_window):
 
 
 
+def read_twf_columnar(twf_path, route_result, n_time_window):
+    # read_twf for the columnar DEF: every (instance, net) timing window as a CSR array indexed by
+    # instance id, window[ptr[i]:ptr[i + 1]] = [start, end] rows, [-1, -1] where read_twf stored 0
+    net_id = {name: i for i, name in enumerate(route_result['net_names'])}
+    rec_net = []
+    rec_zero = []
+    arrivals = []
+    n_arrival = []
+    segments = []  # (first record, time_windows) for every WAVEFORM seen
+    with open(twf_path, 'rb') as read_file:
+        for line in read_file:
+            if b"WAVEFORM" in line:
+                clk = float(line.split()[2])
+                time_windows = np.delete(np.linspace(-1, clk, n_time_window + 1), 0)
+                segments.append((len(rec_net), time_windows))
+            elif b"NET" in line:
+                data = line.split()
+                if b"CONSTANT" in line:
+                    name, zero = data[2], True
+                else:
+                    name, zero = data[1], data[2] == b'*' or data[6] == b'*'
+                rec_net.append(net_id[name.replace(b'\\', b'').replace(b'"', b'').decode()])
+                rec_zero.append(zero)
+                if not zero:
+                    arrivals.append(data[2])
+                    arrivals.append(data[6])
+                    n_arrival.append(data[2].count(b':') + data[6].count(b':') + 2)
+
+    rec_net = np.asarray(rec_net, dtype=np.int64)
+    rec_zero = np.asarray(rec_zero, dtype=bool)
+    window = np.full((rec_net.size, 2), -1, dtype=np.int64)
+
+    # min/max arrival of every net in one pass, then binned per WAVEFORM segment
+    timed = np.flatnonzero(~rec_zero)
+    if timed.size:
+        values = np.array(b' '.join(arrivals).replace(b':', b' ').split(), dtype=np.float64)
+        offsets = np.cumsum(n_arrival) - n_arrival
+        arrive = np.column_stack([np.minimum.reduceat(values, offsets), np.maximum.reduceat(values, offsets)])
+        bounds = [first for first, _ in segments[1:]] + [rec_net.size]
+        for (first, time_windows), last in zip(segments, bounds):
+            sel = (timed >= first) & (timed < last)
+            window[timed[sel]] = np.searchsorted(time_windows, arrive[sel], side='left')
+
+    # expand every net record onto the instances of that net (IO pins are dropped)
+    ptr = route_result['net_pin_ptr']
+    count = ptr[rec_net + 1] - ptr[rec_net]
+    rec = np.repeat(np.arange(rec_net.size), count)
+    local = np.arange(rec.size) - np.repeat(np.cumsum(count) - count, count)
+    instance = route_result['net_pin_instance'][ptr[rec_net][rec] + local]
+    keep = instance >= 0
+    instance = instance[keep]
+    rec = rec[keep]
+
+    order = np.argsort(instance, kind='stable')
+    n_instance = len(route_result['instance_names'])
+    tw_ptr = np.zeros(n_instance + 1, dtype=np.int64)
+    np.cumsum(np.bincount(instance, minlength=n_instance), out=tw_ptr[1:])
+    return {'ptr': tw_ptr, 'window': window[rec[order]], 'n_time_window': n_time_window}
+
+
+
+
+
 def read_power(power_path, lef_dict, tw_dict):
     power_dict = {}
     
@@ -426,29 +657,123 @@ def read_power(power_path, lef_dict, tw_dict):
                         if line.split()[-1] not in lef_dict or not lef_dict[line.split()[-1]]['type'] == 'std_cell':
                             continue
                         data = line.split()
-                        if eval(data[0]) == 0:
+                        if float(data[0]) == 0:
                             if 'FILLER' in name:
                                 power_dict[name] = [0, float(data[2]), float(data[3]), float(data[4]), 'filler']
                             else:
-                                power_dict[name] = [0, float(data[2]), float(data[3]), float(data[4]), tw_dict[name]]
+                                power_dict[name] = [0, float(data[2]), float(data[3]), float(data[4]), tw_dict[name] if tw_dict is not None else None]
                         else:
-                            power_dict[name] = [eval(data[1])/eval(data[0]), float(data[2]), float(data[3]), float(data[4]), tw_dict[name]]
+                            power_dict[name] = [float(data[1])/float(data[0]), float(data[2]), float(data[3]), float(data[4]), tw_dict[name] if tw_dict is not None else None]
                     elif len(line.split()) == 9:
                         if line.split()[-1] not in lef_dict or not lef_dict[line.split()[-1]]['type'] == 'std_cell':
                             continue
                         data = line.split()
                         name = data[0].replace('\\', '')
-                        if eval(data[1]) == 0:
+                        if float(data[1]) == 0:
                             if 'FILLER' in name:
                                 power_dict[name] = [0, float(data[3]), float(data[4]), float(data[5]), 'filler']
                             else:
-                                power_dict[name] = [0, float(data[3]), float(data[4]), float(data[5]), tw_dict[name]]
+                                power_dict[name] = [0, float(data[3]), float(data[4]), float(data[5]), tw_dict[name] if tw_dict is not None else None]
                         else:
-                            power_dict[name] = [eval(data[2])/eval(data[1]), float(data[3]), float(data[4]), float(data[5]), tw_dict[name]]
+                            power_dict[name] = [float(data[2])/float(data[1]), float(data[3]), float(data[4]), float(data[5]), tw_dict[name] if tw_dict is not None else None]
     
     return power_dict
 
 
+def read_power_columnar(power_path, lef_dict, name_to_id):
+    # read_power as columnar arrays keyed by instance id (name_to_id, e.g. gcell_index['name_to_id']);
+    # every row is split once and parsed with float(), a repeated instance overwrites its first row
+    row_of = {}
+    instance, toggle, internal, switching, leakage, master, filler = [], [], [], [], [], [], []
+    master_names = []
+    master_id = {}
+    with open(power_path, 'r') as read_file:
+        start = False
+        read = False
+        name = ''
+        for line in read_file:
+            if not start:
+                start = "Instance" in line
+            if start and line.startswith('Total'):
+                break
+            if not start:
+                continue
+            if not read:
+                read = line.startswith('-')
+                if not read:
+                    continue
+            data = line.split()
+            if len(data) == 1:
+                name = data[0].replace('\\', '')
+                continue
+            elif len(data) == 9:
+                name = data[0].replace('\\', '')
+                data = data[1:]
+            elif len(data) != 8:
+                continue
+            cell = data[-1]
+            if cell not in lef_dict or lef_dict[cell]['type'] != 'std_cell':
+                continue
+            max_toggles = float(data[0])
+            if cell not in master_id:
+                master_id[cell] = len(master_names)
+                master_names.append(cell)
+            values = (name_to_id[name], float(data[1]) / max_toggles if max_toggles != 0 else 0.0,
+                      float(data[2]), float(data[3]), float(data[4]), master_id[cell], max_toggles == 0 and 'FILLER' in name)
+            if name in row_of:
+                for column, value in zip((instance, toggle, internal, switching, leakage, master, filler), values):
+                    column[row_of[name]] = value
+                continue
+            row_of[name] = len(instance)
+            for column, value in zip((instance, toggle, internal, switching, leakage, master, filler), values):
+                column.append(value)
+
+    return {
+        'instance': np.array(instance, dtype=np.int64),
+        'toggle': np.array(toggle, dtype=np.float64),
+        'internal': np.array(internal, dtype=np.float64),
+        'switching': np.array(switching, dtype=np.float64),
+        'leakage': np.array(leakage, dtype=np.float64),
+        'master': np.array(master, dtype=np.int32),
+        'master_names': master_names,
+        'filler': np.array(filler, dtype=bool),
+    }
+
+
+
+def power_dict_to_columnar(power_dict, gcell_index):
+    # read_power output (with read_twf windows) -> (read_power_columnar, read_twf_columnar) shaped pair
+    names = list(power_dict)
+    n = len(names)
+    columns = np.array([v[:4] for v in power_dict.values()], dtype=np.float64).reshape(n, 4)
+    filler = np.array([isinstance(v[4], str) and v[4] == 'filler' for v in power_dict.values()], dtype=bool)
+    count = np.zeros(n, dtype=np.int64)
+    window = []
+    for idx, v in enumerate(power_dict.values()):
+        if filler[idx] or v[4] is None:
+            continue
+        count[idx] = len(v[4])
+        window.extend([-1, -1] if i == 0 else i for i in v[4])
+    ptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(count, out=ptr[1:])
+    power = {
+        'instance': instance_ids(gcell_index, names),
+        'toggle': columns[:, 0],
+        'internal': columns[:, 1],
+        'switching': columns[:, 2],
+        'leakage': columns[:, 3],
+        'master': np.full(n, -1, dtype=np.int32),
+        'master_names': [],
+        'filler': filler,
+    }
+    # windows are stored per power row here, so index them with the row number instead of the instance id
+    timing_windows = {'ptr': ptr, 'window': np.array(window, dtype=np.int64).reshape(-1, 2), 'by_row': True}
+    return power, timing_windows
+
+
+
+
+
 ## Power density functions
 
 def compute_density_with_overlap(density, location_on_coordinate, location_on_gcell, gcell_coordinate_x, gcell_coordinate_y):
@@ -492,47 +817,126 @@ def compute_density_with_overlap(density, location_on_coordinate, location_on_gc
 
 
 
-def get_power_map(power_dict, route_instance_dict, lef_dict, gcell_coordinate_x, gcell_coordinate_y, gcell_size, n_time_window):
-    window_shape = [n_time_window]
-    window_shape.extend(gcell_size)
-    power_t = np.zeros(window_shape)
-    power_i = np.zeros(gcell_size)
-    power_s = np.zeros(gcell_size)
-    power_sca = np.zeros(gcell_size)
-    power_all = np.zeros(gcell_size)
-    power_map = np.zeros(gcell_size)
-
-    for k, v in power_dict.items():
-        if v[4] == 'filler':
-            tw = [0]
-        else:
-            tw = v[4]
-        instance = route_instance_dict[k]
-        cell_size = lef_dict[instance[0]]['size']
-        direction = instance_direction_rect(instance[2])
-        cell_x_left = instance[1][0]
-        cell_y_lower = instance[1][1]
-        cell_x_right = cell_x_left + cell_size[0] * direction[0] + cell_size[1] * direction[1]
-        cell_y_upper = cell_y_lower + cell_size[0] * direction[2] + cell_size[1] * direction[3]
-        cell_x_left_gcell = bisect.bisect_left(gcell_coordinate_x, cell_x_left)
-        cell_y_lower_gcell = bisect.bisect_left(gcell_coordinate_y, cell_y_lower)
-        cell_x_right_gcell = bisect.bisect_left(gcell_coordinate_x, cell_x_right)
-        cell_y_upper_gcell = bisect.bisect_left(gcell_coordinate_y, cell_y_upper)
-        location = [cell_x_left, cell_y_lower, cell_x_right, cell_y_upper]
-        location_gcell = [cell_x_left_gcell, cell_y_lower_gcell, cell_x_right_gcell, cell_y_upper_gcell]
-        tmp_power_map = np.zeros(gcell_size)
-        power_map += compute_density_with_overlap(tmp_power_map, location, location_gcell,gcell_coordinate_x, gcell_coordinate_y)
-        n_pin = len(tw)
-        power_i += power_map * v[1] * n_pin
-        power_s += power_map * v[2] * n_pin
-        power_sca += power_map * ((v[1] + v[2]) * v[0] + v[3]) * n_pin
-        power_all += power_map * (v[1] + v[2] + v[3]) * n_pin
-        if tw:
-            for i in tw:
-                if i == 0:
-                    pass
-                else:
-                    power_t[i[0]:i[1]+1, :, :] += power_map * ((v[1] + v[2]) * v[0] + v[3])
+def get_instance_rects(instance_names, route_instance_dict, lef_dict):
+    # [x_left, y_lower, x_right, y_upper] of every named instance as an (n, 4) array.
+    n = len(instance_names)
+    origin = np.empty((n, 2))
+    size = np.empty((n, 2))
+    rotated = np.empty(n, dtype=bool)
+    for i, name in enumerate(instance_names):
+        instance = route_instance_dict[name]
+        origin[i] = instance[1]
+        size[i] = master_size(lef_dict, instance[0])
+        rotated[i] = instance_direction_rect(instance[2])[0] == 0
+    width = np.where(rotated, size[:, 1], size[:, 0])
+    height = np.where(rotated, size[:, 0], size[:, 1])
+    return np.column_stack([origin[:, 0], origin[:, 1], origin[:, 0] + width, origin[:, 1] + height])
+
+
+
+def get_gcell_span(rects, gcell_coordinate_x, gcell_coordinate_y):
+    # bisect_left of every rect edge, as [left, lower, right, upper] gcell indices (not clamped)
+    rects = np.asarray(rects, dtype=np.float64).reshape(-1, 4)
+    return np.column_stack([
+        np.searchsorted(gcell_coordinate_x, rects[:, 0], side='left'),
+        np.searchsorted(gcell_coordinate_y, rects[:, 1], side='left'),
+        np.searchsorted(gcell_coordinate_x, rects[:, 2], side='left'),
+        np.searchsorted(gcell_coordinate_y, rects[:, 3], side='left'),
+    ])
+
+
+
+def rasterize_instances(rects, gcell_coordinate_x, gcell_coordinate_y, span=None):
+    # Batched compute_density_with_overlap: overlap fraction of every rect with every gcell it touches.
+    # Returns COO triplets (instance row, flattened gcell index, overlap), gcell index = x * n_y + y.
+    rects = np.asarray(rects, dtype=np.float64).reshape(-1, 4)
+    x_left, y_lower, x_right, y_upper = rects.T
+    n_x = gcell_coordinate_x.size
+    n_y = gcell_coordinate_y.size
+    if span is None:
+        span = get_gcell_span(rects, gcell_coordinate_x, gcell_coordinate_y)
+
+    gcell_left = np.minimum(span[:, 0], n_x - 1)
+    gcell_lower = np.minimum(span[:, 1], n_y - 1)
+    gcell_right = np.minimum(span[:, 2], n_x - 1)
+    gcell_upper = np.minimum(span[:, 3], n_y - 1)
+
+    # same edge handling as compute_density_with_overlap (index -1 wraps around there as well)
+    gcell_left = np.where(x_left == gcell_coordinate_x[gcell_left - 1], gcell_right, gcell_left)
+    gcell_lower = np.where(y_lower == gcell_coordinate_y[gcell_lower - 1], gcell_upper, gcell_lower)
+
+    # my_range: a single gcell when start == end, otherwise [start, end)
+    span_x = np.where(gcell_left == gcell_right, 1, np.maximum(gcell_right - gcell_left, 0))
+    span_y = np.where(gcell_lower == gcell_upper, 1, np.maximum(gcell_upper - gcell_lower, 0))
+    count = span_x * span_y
+
+    row = np.repeat(np.arange(rects.shape[0]), count)
+    local = np.arange(row.size) - np.repeat(np.cumsum(count) - count, count)
+    j = gcell_left[row] + local // span_y[row]
+    k = gcell_lower[row] + local % span_y[row]
+
+    left = np.where(j == 0, -10, gcell_coordinate_x[j - 1])  # the border of die is -10
+    lower = np.where(k == 0, -10, gcell_coordinate_y[k - 1])
+    right = gcell_coordinate_x[j]
+    upper = gcell_coordinate_y[k]
+    overlap = ((np.minimum(right, x_right[row]) - np.maximum(left, x_left[row]))
+               * (np.minimum(upper, y_upper[row]) - np.maximum(lower, y_lower[row]))) / ((right - left) * (upper - lower))
+
+    return row, j * n_y + k, overlap
+
+
+
+def scatter_to_gcell(row, gcell, overlap, weight, gcell_size):
+    # sparse (gcell x instance) @ weight, i.e. sum of overlap * weight[instance] per gcell
+    flat = np.bincount(gcell, weights=overlap * weight[row], minlength=gcell_size[0] * gcell_size[1])
+    return flat.reshape(gcell_size)
+
+
+
+def get_power_map(power, gcell_index, n_time_window, timing_windows, cumulative=True):
+    # power: read_power_columnar, timing_windows: read_twf_columnar (power_dict_to_columnar for the dict readers).
+    # cumulative=True reproduces the original per-instance loop, where power_map kept the density of
+    # every instance visited before (report order); the existing datasets were extracted that way.
+    ids = power['instance']
+    n = ids.size
+    toggle = power['toggle']
+    internal = power['internal']
+    switching = power['switching']
+    leakage = power['leakage']
+    filler = power['filler']
+
+    # fillers count as one pin without a timing window, everything else has one entry per net pin
+    tw_ptr = timing_windows['ptr']
+    first = np.arange(n) if timing_windows.get('by_row') else ids
+    count = np.where(filler, 0, tw_ptr[first + 1] - tw_ptr[first])
+    n_pin = np.where(filler, 1, count)
+    tw_row = np.repeat(np.arange(n), count)
+    local = np.arange(tw_row.size) - np.repeat(np.cumsum(count) - count, count)
+    window = timing_windows['window'][tw_ptr[first][tw_row] + local]
+    timed = window[:, 0] >= 0
+    tw_row, tw_start, tw_end = tw_row[timed], window[timed, 0], window[timed, 1]
+
+    sca = (internal + switching) * toggle + leakage
+    weights = np.column_stack([internal * n_pin, switching * n_pin, sca * n_pin, (internal + switching + leakage) * n_pin])
+
+    # per-instance window weights; each [start, end] timing window adds sca to windows start..end
+    window_weight = np.zeros((n, n_time_window + 2))
+    np.add.at(window_weight, (tw_row, tw_start), sca[tw_row])
+    np.add.at(window_weight, (tw_row, tw_end + 1), -sca[tw_row])
+    window_weight = np.cumsum(window_weight, axis=1)[:, :n_time_window]
+
+    if cumulative:
+        weights = np.cumsum(weights[::-1], axis=0)[::-1]
+        window_weight = np.cumsum(window_weight[::-1], axis=0)[::-1]
+
+    # spread the per-instance weights onto every instance of the index (zero for cells without power)
+    full_weights = np.zeros((len(gcell_index['names']), 4))
+    full_weights[ids] = weights
+    full_window_weight = np.zeros((len(gcell_index['names']), n_time_window))
+    full_window_weight[ids] = window_weight
+
+    power_i, power_s, power_sca, power_all = [index_to_gcell(gcell_index, full_weights[:, c]) for c in range(4)]
+    power_t = np.stack([index_to_gcell(gcell_index, full_window_weight[:, t]) for t in range(n_time_window)])
 
     return power_t, power_i, power_s, power_sca, power_all
 
@@ -540,7 +944,7 @@ def get_power_map(power_dict, route_instance_dict, lef_dict, gcell_coordinate_x,
 ## Decap map generation functions
 #read_decap : extract the decap position from .def and find it's capacitance size and its physical dimension from lef
 
-def create_decap_map(route_instance_dict, lef_dict):
+def create_decap_map(gcell_index, lef_dict):
     # Example decap_value dictionary
     decap_value = {
         'DECAP2': 1.2,
@@ -556,10 +960,10 @@ def create_decap_map(route_instance_dict, lef_dict):
 
     decap_map = {}
 
-    for instance, details in route_instance_dict.items():
-        cell_name = details[0]
-        location = details[1]
-        direction = details[2]
+    for i, instance in enumerate(gcell_index['names']):
+        cell_name = gcell_index['cell_names'][i]
+        location = tuple(gcell_index['rects'][i, :2])
+        direction = gcell_index['orients'][i]
 
         # Check if the cell is a decap
         if 'DECAP' in cell_name:
@@ -576,61 +980,111 @@ def create_decap_map(route_instance_dict, lef_dict):
     return decap_map
 
 
-def get_decap_position_map(decap_map, gcell_coordinate_x, gcell_coordinate_y, gcell_size):
-    decap_position_map = np.zeros(gcell_size)
-
-    for instance, details in decap_map.items():
-        cell_size = details['size']
-        cell_name = details ['cell_name']
-        direction = instance_direction_rect(details['direction'])
-        cell_x_left = details['location'][0]
-        cell_y_lower = details['location'][1]
-        
-        cell_x_right = cell_x_left + cell_size[0] * direction[0] + cell_size[1] * direction[1]
-        cell_y_upper = cell_y_lower + cell_size[0] * direction[2] + cell_size[1] * direction[3]
-
-        
-        cell_x_left_gcell = bisect.bisect_left(gcell_coordinate_x, cell_x_left)
-        cell_y_lower_gcell = bisect.bisect_left(gcell_coordinate_y, cell_y_lower)
-        cell_x_right_gcell = bisect.bisect_left(gcell_coordinate_x, cell_x_right)
-        cell_y_upper_gcell = bisect.bisect_left(gcell_coordinate_y, cell_y_upper)
-
-        location = [cell_x_left, cell_y_lower, cell_x_right, cell_y_upper]
-        location_gcell = [cell_x_left_gcell, cell_y_lower_gcell, cell_x_right_gcell, cell_y_upper_gcell]
-        
-        # Fill the grid cells corresponding to the decap cell location
-        for x in range(cell_x_left_gcell, cell_x_right_gcell + 1):
-            for y in range(cell_y_lower_gcell, cell_y_upper_gcell + 1):
-                decap_position_map[x, y] += details['capacitance']
-    
+def get_decap_position_map(decap_map, gcell_index):
+    decap_position_map = np.zeros(gcell_index['gcell_size'])
+    if not decap_map:
+        return decap_position_map
+
+    ids = instance_ids(gcell_index, list(decap_map))
+    capacitance = np.array([float(details['capacitance']) for details in decap_map.values()])
+    span = gcell_index['span'][ids]
+
+    # Fill the grid cells corresponding to the decap cell location (both span ends inclusive)
+    span_x = np.maximum(span[:, 2] - span[:, 0] + 1, 0)
+    span_y = np.maximum(span[:, 3] - span[:, 1] + 1, 0)
+    count = span_x * span_y
+    row = np.repeat(np.arange(ids.size), count)
+    local = np.arange(row.size) - np.repeat(np.cumsum(count) - count, count)
+    x = span[row, 0] + local // span_y[row]
+    y = span[row, 1] + local % span_y[row]
+    np.add.at(decap_position_map, (x, y), capacitance[row])
+
     return decap_position_map
 
 
 
 
     
-def get_IR(gcell_size,gcell_coordinate_x, gcell_coordinate_y,ir_path):
-    ir_map = np.zeros(gcell_size)
-    with open(ir_path, 'r') as read_file:
-        read = False
-        for line in read_file:
-            if line.startswith('Range'):
-                read = False
-            if read:
-                data = line.split()
-                if len(data) >= 5:  # Ensure there are enough columns to avoid IndexError
-                    ir_value = float(data[0])
-                    metal_layer = data[1]
-                    x_coord = float(data[2]) * unit_value
-                    y_coord = float(data[3]) * unit_value
-                    gcell_x = bisect.bisect_left(gcell_coordinate_x, x_coord)
-                    gcell_y = bisect.bisect_left(gcell_coordinate_y, y_coord)
-                    if ir_value > ir_map[gcell_x, gcell_y]:
-                        ir_map[gcell_x, gcell_y] = ir_value
-            if line.startswith('ir'):
+IR_TABLE_START = re.compile(rb'^ir', re.M)
+IR_TABLE_END = re.compile(rb'^Range', re.M)
+
+
+def parse_ir_rows(rows):
+    # ir value, x, y of every node row; the rare malformed table falls back to the old per-line filter
+    try:
+        return np.loadtxt(io.BytesIO(rows), usecols=(0, 2, 3), ndmin=2, comments=None)
+    except ValueError:
+        data = [line.split() for line in rows.split(b'\n')]
+        return np.array([[float(d[0]), float(d[2]), float(d[3])] for d in data if len(d) >= 5]).reshape(-1, 3)
+
+
+
+def read_ir_nodes(gcell_index, ir_path, block_size=1 << 24):
+    # flattened gcell index (x * n_y + y) and IR value of every node in the report, read in bulk blocks
+    gcell = []
+    ir = []
+    read = False
+    for block in iter_blocks(ir_path, block_size):
+        pos = 0
+        while pos < len(block):
+            if not read:
+                start = IR_TABLE_START.search(block, pos)
+                if start is None:
+                    break
+                pos = block.find(b'\n', start.end()) + 1 or len(block)  # skip the column header
                 read = True
+                continue
+            end = IR_TABLE_END.search(block, pos)
+            stop = end.start() if end else len(block)
+            nodes = parse_ir_rows(block[pos:stop])
+            if nodes.size:
+                gcell_x, gcell_y = locate_gcell(gcell_index, nodes[:, 1] * unit_value, nodes[:, 2] * unit_value)
+                gcell.append(gcell_x * gcell_index['gcell_size'][1] + gcell_y)
+                ir.append(nodes[:, 0])
+                if (gcell_x >= gcell_index['gcell_size'][0]).any() or (gcell_y >= gcell_index['gcell_size'][1]).any():
+                    raise IndexError(f"IR node outside of the gcell grid in {ir_path}")
+            pos = stop
+            if end is not None:
+                read = False
+    if not gcell:
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+    return np.concatenate(gcell), np.concatenate(ir)
+
+
+
+def reduce_ir(gcell_index, gcell, ir, reduction='max'):
+    # 'max' is the original label (starting from 0, so negative drops never show up),
+    # 'mean' the average node IR drop and 'p<q>' (e.g. 'p95') the q-th percentile per gcell
+    gcell_size = gcell_index['gcell_size']
+    n_cell = gcell_size[0] * gcell_size[1]
+    if reduction == 'max':
+        ir_map = np.zeros(n_cell)
+        np.maximum.at(ir_map, gcell, ir)
+    elif reduction == 'mean':
+        count = np.bincount(gcell, minlength=n_cell)
+        ir_map = np.bincount(gcell, weights=ir, minlength=n_cell) / np.maximum(count, 1)
+    elif reduction.startswith('p'):
+        q = float(reduction[1:]) / 100
+        order = np.lexsort((ir, gcell))
+        gcell, ir = gcell[order], ir[order]
+        count = np.bincount(gcell, minlength=n_cell)
+        first = np.cumsum(count) - count
+        has = count > 0
+        position = q * (count[has] - 1)  # linear interpolation, as np.percentile
+        lower = np.floor(position).astype(np.int64)
+        upper = np.ceil(position).astype(np.int64)
+        low_value = ir[first[has] + lower]
+        ir_map = np.zeros(n_cell)
+        ir_map[has] = low_value + (ir[first[has] + upper] - low_value) * (position - lower)
+    else:
+        raise ValueError(f'unknown IR reduction: {reduction}')
+    return ir_map.reshape(gcell_size)
+
 
-    return ir_map 
+
+def get_IR(gcell_index, ir_path, reduction='max'):
+    gcell, ir = read_ir_nodes(gcell_index, ir_path)
+    return reduce_ir(gcell_index, gcell, ir, reduction)
 
 
 ## Power pad distance mapping functions
@@ -657,123 +1111,213 @@ def read_power_pad_files(pp_pattern):
 
 
 
-# Function to create separate VDD and VSS power pad distance maps
-def get_power_pad_distance_maps(route_instance_dict, vdd_pads, gcell_coordinate_x, gcell_coordinate_y, gcell_size):
-    vdd_distance_map = np.zeros(gcell_size)  # VDD distance map
-    #vss_distance_map = np.zeros(gcell_size)  # VSS distance map
+def gcell_centers(gcell_index):
+    # x and y centre of every gcell column / row (the die border left of / below gcell 0 is -10)
+    edge_x = np.concatenate([[-10], gcell_index['gcell_coordinate_x']])
+    edge_y = np.concatenate([[-10], gcell_index['gcell_coordinate_y']])
+    return (edge_x[:-1] + edge_x[1:]) / 2, (edge_y[:-1] + edge_y[1:]) / 2
+
 
-    # Iterate over instances in route_instance_dict
-    for instance, details in route_instance_dict.items():
-        cell_x_left = details[1][0]  # x-coordinate of instance
-        cell_y_lower = details[1][1]  # y-coordinate of instance
 
-        # Find the grid cell for the instance using binary search
-        cell_x_gcell = bisect.bisect_left(gcell_coordinate_x, cell_x_left)
-        cell_y_gcell = bisect.bisect_left(gcell_coordinate_y, cell_y_lower)
+def pad_distance(points, pads, layer_resistance=None, k_nearest=8):
+    # Euclidean distance from every point to the nearest pad through a KD-tree, O((n + m) log m).
+    # With layer_resistance ({pad layer: resistance per unit length}) the k nearest pads are instead
+    # combined as parallel resistors, 1 / sum(1 / (d * r)), an effective-resistance-weighted distance.
+    if not pads:
+        raise ValueError('no power pads to measure the distance to')
+    pad_xy = np.array([(x, y) for _, x, y, _ in pads], dtype=np.float64)
+    tree = cKDTree(pad_xy)
+    if layer_resistance is None:
+        distance, _ = tree.query(points)
+        return distance
 
-        # Calculate minimum distance to VDD pads
-        min_vdd_distance = min(euclidean_distance(cell_x_left, cell_y_lower, vdd_x, vdd_y) for _, vdd_x, vdd_y, _ in vdd_pads)
+    k = min(k_nearest, len(pads))
+    distance, nearest = tree.query(points, k=k)
+    distance = distance.reshape(len(points), k)
+    nearest = nearest.reshape(len(points), k)
+    resistance = np.array([layer_resistance.get(layer, 1.0) for _, _, _, layer in pads])[nearest]
+    path = np.maximum(distance * resistance, 1e-12)  # a point on top of a pad has no resistance to it
+    return 1 / (1 / path).sum(axis=1)
 
-        # Calculate minimum distance to VSS pads
-        #min_vss_distance = min(euclidean_distance(cell_x_left, cell_y_lower, vss_x, vss_y) for _, vss_x, vss_y, _ in vss_pads)
 
-        # Assign the distances to the corresponding grid cell
-        vdd_distance_map[cell_x_gcell, cell_y_gcell] = min_vdd_distance  # VDD distance
-        #vss_distance_map[cell_x_gcell, cell_y_gcell] = min_vss_distance  # VSS distance
+
+# Function to create separate VDD and VSS power pad distance maps
+def get_power_pad_distance_maps(gcell_index, vdd_pads, mode='instance', layer_resistance=None, k_nearest=8):
+    # mode='instance': distance of each instance's lower-left corner, written to its gcell (as before);
+    # mode='gcell': distance of every gcell centre, so gcells without instances get a value too
+    vdd_distance_map = np.zeros(gcell_index['gcell_size'])  # VDD distance map
+    #vss_distance_map = np.zeros(gcell_size)  # VSS distance map
+
+    if mode == 'gcell':
+        center_x, center_y = gcell_centers(gcell_index)
+        grid_x, grid_y = np.meshgrid(center_x, center_y, indexing='ij')
+        points = np.column_stack([grid_x.ravel(), grid_y.ravel()])
+        return pad_distance(points, vdd_pads, layer_resistance, k_nearest).reshape(vdd_distance_map.shape)
+    elif mode != 'instance':
+        raise ValueError(f'unknown pad distance mode: {mode}')
+
+    # lower-left corner of every instance and the grid cell it falls in
+    cell_x = gcell_index['rects'][:, 0]
+    cell_y = gcell_index['rects'][:, 1]
+    cell_x_gcell, cell_y_gcell = locate_gcell(gcell_index, cell_x, cell_y)
+    min_vdd_distance = pad_distance(np.column_stack([cell_x, cell_y]), vdd_pads, layer_resistance, k_nearest)
+
+    # Assign the distances to the corresponding grid cell; the last instance (DEF order) wins, as before
+    flat = cell_x_gcell * vdd_distance_map.shape[1] + cell_y_gcell
+    _, last = np.unique(flat[::-1], return_index=True)
+    last = flat.size - 1 - last
+    vdd_distance_map[cell_x_gcell[last], cell_y_gcell[last]] = min_vdd_distance[last]  # VDD distance
 
     return vdd_distance_map
 
  
 
-def process_folder(folder_path):
+POWER_MAPS = ('power_t', 'power_i', 'power_s', 'power_sca', 'power_all')
+# output map name -> file relative to the design output folder
+MAP_FILES = {name: os.path.join(name, name + '.npy') for name in POWER_MAPS}
+MAP_FILES.update({'decap': 'decap/decap.npy', 'VDD_Map': 'VDD_Map/vdd_map.npy', 'IR_drop': 'IR_drop/ir_map.npy'})
+
+
+def power_stage(design, lef_dict, inputs):
+    timing_windows = read_twf_columnar(inputs['twf'], design, inputs['n_time_window'])
+    print(".twf file processed")
+    power = read_power_columnar(inputs['power'], lef_dict, design['name_to_id'])
+    print("Power file processed")
+    return dict(zip(POWER_MAPS, get_power_map(power, design, inputs['n_time_window'], timing_windows)))
+
+
+def decap_stage(design, lef_dict, inputs):
+    decap_map = create_decap_map(design, lef_dict)
+    return {'decap': get_decap_position_map(decap_map, design)}
+
+
+def vdd_stage(design, lef_dict, inputs):
+    vdd_pads = read_power_pad_files(os.path.join(inputs['folder'], "VDD*.pp"))
+    return {'VDD_Map': get_power_pad_distance_maps(design, vdd_pads)}
+
+
+def ir_stage(design, lef_dict, inputs):
+    return {'IR_drop': get_IR(design, inputs['ir'])}
+
+
+STAGES = {'power': power_stage, 'decap': decap_stage, 'vdd': vdd_stage, 'ir': ir_stage}
+
+
+def run_stage(stage, design, inputs):
+    # design: the parsed design (route_result and gcell_index keys), or the path of its design_store
+    start = time.perf_counter()
+    if isinstance(design, str):
+        design = design_store.load_design(design)
+    maps = STAGES[stage](design, get_lef_library(lef_path, unit_value).lef_dict, inputs)
+    print(f"{stage} maps generated")
+    return stage, maps, time.perf_counter() - start
+
+
+def save_stage(output_path, manifest, hashes, summary, stage, maps, seconds):
+    for name, data in maps.items():
+        save(output_path, os.path.dirname(MAP_FILES[name]), os.path.basename(MAP_FILES[name])[:-len('.npy')], data)
+        extraction_cache.record_map(output_path, manifest, hashes, name, MAP_FILES[name])
+    summary['seconds'][stage] = seconds
+
+
+def extract_folder(folder_path, output_path, incremental=True, stage_workers=1, n_def_workers=None):
+    # Extract every stale feature map of one design into output_path; raises on the first failure.
+    # After the DEF parse the power (TWF + power report), decap, pad distance and IR stages are
+    # independent; with stage_workers > 1 they run in that many processes. n_def_workers defaults to
+    # the module's def_workers (pass it explicitly from spawned workers, which do not see changes to it).
+    # Returns the maps written and stage times.
     folder_name = os.path.basename(folder_path)
-    output_path = os.path.join('/mnt/research/Hu_Jiang/Students/Poudel_Bidhan/extracted_features2', folder_name)
+    if not os.path.exists(output_path):
+        os.makedirs(output_path)
+
+    # Check that all input files exist
+    route_def_path = os.path.join(folder_path, 'detailed_route.def.gz')
+    twf_path = os.path.join(folder_path, 'cts.twf')
+    power_path = os.path.join(folder_path, 'dyn_power.rpt')
+    ir_path = os.path.join(folder_path, 'route_dynamic_ir.rpt')
+    for kind, path in (('LEF', lef_path), ('.DEF', route_def_path), ('.twf', twf_path),
+                       ('Power report', power_path), ('IR drop', ir_path)):
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"{kind} file not found: {path}")
+    vdd_pad_paths = glob.glob(os.path.join(folder_path, "VDD*.pp"))
+    n_time_window = 20
+
+    # Find the maps whose inputs changed since the last run
+    manifest = extraction_cache.load_manifest(output_path) if incremental else {'files': {}, 'maps': {}}
+    hashes = extraction_cache.input_hashes({
+        'def': route_def_path, 'lef': lef_path, 'twf': twf_path, 'power': power_path,
+        'ir': ir_path, 'pp': vdd_pad_paths, 'unit': unit_value, 'n_time_window': n_time_window}, manifest)
+    stale = extraction_cache.stale_maps(output_path, manifest, hashes, MAP_FILES) if incremental else set(MAP_FILES)
+    summary = {'design': folder_name, 'maps': sorted(stale), 'seconds': {}}
+    if not stale:
+        print(f"{folder_name} is up to date")
+        return summary
+    print(f"Regenerating {sorted(stale)} for {folder_name}")
+
+    start = time.perf_counter()
+    lef_library = get_lef_library(lef_path, unit_value)
+    lef_dict = lef_library.lef_dict
+    print("LEF file processed")
+
+    result = read_route_def_columnar(route_def_path, n_workers=n_def_workers or def_workers)
+    gcell_index = build_gcell_index(result, lef_dict)
+    summary['seconds']['def'] = time.perf_counter() - start
+    if gcell_index['unknown_masters']:
+        summary['unknown_masters'] = gcell_index['unknown_masters']
+    print(".DEF file processed")
+
+    stages = []
+    if stale.intersection(POWER_MAPS):
+        stages.append('power')
+    if 'decap' in stale:
+        stages.append('decap')
+    if 'VDD_Map' in stale:
+        stages.append('vdd')
+    if 'IR_drop' in stale:
+        stages.append('ir')
+    inputs = {'folder': folder_path, 'twf': twf_path, 'power': power_path, 'ir': ir_path, 'n_time_window': n_time_window}
+
+    # Stages run one after another in this process, or with stage_workers > 1 in separate processes
+    # that map the parsed design from a shared design store (the stages are pure-Python parsing
+    # and hold the GIL, so threads would not overlap them); a failing stage does not stop the
+    # others, its error is raised once they are done
+    store_path = None
+    if stage_workers > 1 and len(stages) > 1:
+        design = store_path = design_store.save_design(result, gcell_index)
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=min(stage_workers, len(stages)))
+    else:
+        design = dict(result, **gcell_index)
+        executor = None
+    errors = []
     try:
-        if not os.path.exists(output_path):
-            os.makedirs(output_path)
-
-        # Check if the LEF file exists
-        lef_path = 'LEF/gsclib045_macro.lef'
-        if not os.path.exists(lef_path):
-            raise FileNotFoundError(f"LEF file not found: {lef_path}")
-        lef_dict = {}
-        lef_dict = read_lef(lef_path, lef_dict, unit_value)
-        print("LEF file processed")
-
-
-        lef_dic = {}
-        lef_dic = read_lef_pin_map(lef_path, lef_dic, unit_value)
-
-        
-        # Check if the .DEF file exists
-        route_def_path = os.path.join(folder_path, 'detailed_route.def.gz')
-        if not os.path.exists(route_def_path):
-            raise FileNotFoundError(f".DEF file not found: {route_def_path}")
-        result = read_route_def(route_def_path)
-        print(".DEF file processed")
-
-        # Access the results from the .DEF file
-        gcell_size = result['gcell_size']
-        gcell_coordinate_x = result['gcell_coordinate_x']
-        gcell_coordinate_y = result['gcell_coordinate_y']
-        route_instance_dict = result['route_instance_dict']
-        route_net_dict = result['route_net_dict']
-        route_pin_dict = result['route_pin_dict']
-
-        # Check if the .twf file exists
-        twf_path = os.path.join(folder_path, 'cts.twf')
-        if not os.path.exists(twf_path):
-            raise FileNotFoundError(f".twf file not found: {twf_path}")
-        n_time_window = 20
-        tw_dict = read_twf(twf_path, route_net_dict, n_time_window)
-        print(".twf file processed")
-
-
-        
-        # Check if the power file exists
-        power_path = os.path.join(folder_path, 'dyn_power.rpt')
-        if not os.path.exists(power_path):
-            raise FileNotFoundError(f"Power report file not found: {power_path}")
-        power_dict = read_power(power_path, lef_dict, tw_dict)
-        print("Power file processed")
-
-        # Generate power maps
-        power_t, power_i, power_s, power_sca, power_all = get_power_map(
-            power_dict, route_instance_dict, lef_dict, 
-            gcell_coordinate_x, gcell_coordinate_y, gcell_size, n_time_window=20
-        )
-        save(output_path, 'power_t', 'power_t', power_t)
-        save(output_path, 'power_i', 'power_i', power_i)
-        save(output_path, 'power_s', 'power_s', power_s)
-        save(output_path, 'power_sca', 'power_sca', power_sca)
-        save(output_path, 'power_all', 'power_all', power_all)
-        print("Power maps generated and saved")
-
-        # Generate decap position map
-        decap_map = create_decap_map(route_instance_dict, lef_dict)
-        decap_position_map = get_decap_position_map(decap_map, gcell_coordinate_x, gcell_coordinate_y, gcell_size)
-        save(output_path, 'decap', 'decap', decap_position_map)
-        print("Decap position map saved")
-
-        # Generate power pad distance maps
-        vdd_pads = read_power_pad_files(os.path.join(folder_path, "VDD*.pp"))
-        #vss_pads = read_power_pad_files(os.path.join(folder_path, "VSS*.pp"))
-        vdd_distance_map = get_power_pad_distance_maps(
-            route_instance_dict, vdd_pads, gcell_coordinate_x, gcell_coordinate_y, gcell_size
-        )
-        save(output_path, 'VDD_Map', 'vdd_map', vdd_distance_map)
-        #save(output_path, 'VSS_Map', 'vss_map', vss_distance_map)
-        print("Power pad distance maps saved")
-
-        # Perform IR mapping
-        ir_path = os.path.join(folder_path, 'route_dynamic_ir.rpt')
-        if not os.path.exists(ir_path):
-            raise FileNotFoundError(f"IR drop file not found: {ir_path}")
-        ir_map = get_IR(gcell_size, gcell_coordinate_x, gcell_coordinate_y, ir_path)
-        
-        save(output_path, 'IR_drop', 'ir_map', ir_map)
-        print("IR map generated and saved")
-
+        if executor is not None:
+            with executor:
+                futures = [executor.submit(run_stage, stage, design, inputs) for stage in stages]
+                for future in concurrent.futures.as_completed(futures):
+                    if future.exception() is not None:
+                        errors.append(future.exception())
+                    else:
+                        save_stage(output_path, manifest, hashes, summary, *future.result())
+        else:
+            for stage in stages:
+                try:
+                    save_stage(output_path, manifest, hashes, summary, *run_stage(stage, design, inputs))
+                except Exception as e:
+                    errors.append(e)
+    finally:
+        if store_path is not None:
+            design_store.drop_design(store_path)
+    if errors:
+        raise errors[0]
+    summary['seconds']['total'] = time.perf_counter() - start
+    return summary
+
+
+def process_folder(folder_path, incremental=True):
+    folder_name = os.path.basename(folder_path)
+    output_path = os.path.join(output_root, folder_name)
+    try:
+        extract_folder(folder_path, output_path, incremental)
         # Final print statement
         print(f"Processed {folder_name}")
 
@@ -782,12 +1326,19 @@ def process_folder(folder_path):
 
 # Your process_folder function here
 unit_value = 2000
+def_workers = 1  # >1 parses COMPONENTS/NETS of each DEF in that many processes (for a few very large designs)
+lef_path = 'LEF/gsclib045_macro.lef'
+output_root = '/mnt/research/Hu_Jiang/Students/Poudel_Bidhan/extracted_features2'
 if __name__ == '__main__':
     # Correctly get the list of subfolders under 'data/' using glob
     folder_paths = glob.glob('/mnt/research/Hu_Jiang/Students/Poudel_Bidhan/data1/home/grads/b/bidhanpoudel/Design-files/Data/*')  # This will return a list of subfolder paths
     # Print folder paths for debugging
     print(f"Processing the following folders: {folder_paths}")
 
-    # Parallel processing to handle multiple folders
-    with concurrent.futures.ProcessPoolExecutor() as executor:
-        executor.map(process_folder, folder_paths)
\ No newline at end of file
+    # Largest designs first, dynamically dispatched, failures retried and summarised (see scheduler.py);
+    # the scheduler imports this file as a module, so its settings are the ones above
+    import scheduler
+    os.makedirs(output_root, exist_ok=True)
+    scheduler.schedule(folder_paths, output_root,
+                       quarantine_path=os.path.join(output_root, 'quarantine.json'),
+                       summary_path=os.path.join(output_root, 'run_summary.json'))
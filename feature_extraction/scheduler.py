@@ -0,0 +1,232 @@
+import os
+import sys
+import json
+import glob
+import time
+import argparse
+import traceback
+import concurrent.futures
+
+import feature_extraction
+
+
+## Extraction scheduler: largest-first dynamic dispatch with retries and a run summary
+#
+# Designs are sorted by the size of their DEF and reports (a good proxy for parse time) and handed out
+# largest first, one at a time, to whichever worker is free. The few huge designs therefore start
+# immediately and the many small ones fill the gaps, instead of round-robin lists (divide_n) or
+# executor.map chunks leaving one worker with all the big designs.
+
+INPUT_FILES = ('detailed_route.def.gz', 'cts.twf', 'dyn_power.rpt', 'route_dynamic_ir.rpt')
+TRAINING_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Training')
+
+
+def packed_dataset():
+    # Training/packed_dataset.py, imported only when extraction also packs its output
+    if TRAINING_DIR not in sys.path:
+        sys.path.append(TRAINING_DIR)
+    import packed_dataset
+    return packed_dataset
+
+
+def job_size(folder_path):
+    size = 0
+    for name in INPUT_FILES:
+        path = os.path.join(folder_path, name)
+        if os.path.exists(path):
+            size += os.path.getsize(path)
+    return size
+
+
+def limit_memory(max_bytes):
+    # worker initializer: a design exceeding the address space cap fails with MemoryError
+    # (and is retried / quarantined) instead of driving the node into swap or the OOM killer
+    if max_bytes:
+        import resource
+        resource.setrlimit(resource.RLIMIT_AS, (max_bytes, max_bytes))
+
+
+def run_job(folder_path, output_root, incremental, stage_workers, def_workers, pack=False):
+    # with pack, the worker also preprocesses the finished design for the packed dataset and
+    # returns its arrays under 'pack'; the parent appends them to the dataset as designs complete
+    start = time.perf_counter()
+    try:
+        output_path = os.path.join(output_root, os.path.basename(folder_path))
+        summary = feature_extraction.extract_folder(folder_path, output_path, incremental, stage_workers, def_workers)
+        if pack:
+            summary['pack'] = packed_dataset().design_arrays(output_path)
+        summary['status'] = 'ok'
+    except BaseException as e:
+        summary = {'design': os.path.basename(folder_path), 'status': 'failed',
+                   'error': f'{type(e).__name__}: {e}', 'traceback': traceback.format_exc()}
+    summary['wall_seconds'] = time.perf_counter() - start
+    summary['pid'] = os.getpid()
+    return summary
+
+
+def load_quarantine(quarantine_path):
+    if quarantine_path and os.path.exists(quarantine_path):
+        with open(quarantine_path, 'r') as f:
+            return json.load(f)
+    return {}
+
+
+def write_json(path, data):
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def schedule(folder_paths, output_root, n_workers=None, stage_workers=1, def_workers=1, memory_limit=None,
+             retries=1, incremental=True, quarantine_path=None, summary_path=None, retry_quarantined=False, pack_path=None):
+    # Runs every design, retrying a failed one up to `retries` times. Designs that still fail are
+    # added to the quarantine file and skipped by later runs unless retry_quarantined is set.
+    # A worker that dies (segfault, OOM kill) breaks the pool: it is rebuilt and the designs in
+    # flight are charged one attempt each. With pack_path every design that succeeds is streamed into
+    # a packed dataset (Training/packed_dataset.py) as soon as it finishes.
+    n_workers = n_workers or os.cpu_count()
+    quarantine = load_quarantine(quarantine_path)
+    jobs = []
+    skipped = []
+    for folder_path in folder_paths:
+        if os.path.basename(folder_path) in quarantine and not retry_quarantined:
+            skipped.append(os.path.basename(folder_path))
+        else:
+            jobs.append((job_size(folder_path), folder_path))
+    jobs.sort(key=lambda job: -job[0])
+    pending = [folder_path for _, folder_path in jobs]
+    size_of = {folder_path: size for size, folder_path in jobs}
+    attempts = {folder_path: 0 for folder_path in pending}
+    results = {}
+    not_started = {}
+    busy_of = {folder_path: 0.0 for folder_path in pending}  # worker seconds over every attempt
+    submitted_at = {}
+    finished = 0
+
+    writer = None
+    if pack_path:
+        packing = packed_dataset()
+        writer = packing.PackedDatasetWriter(pack_path, packing.channel_names(packing.FEATURES))
+
+    # parse (or load) the LEF once here so every forked worker inherits it
+    feature_extraction.get_lef_library(feature_extraction.lef_path, feature_extraction.unit_value)
+
+    start = time.perf_counter()
+    while pending:
+        in_flight = {}
+        submitting = None
+        with concurrent.futures.ProcessPoolExecutor(n_workers, initializer=limit_memory,
+                                                    initargs=(memory_limit,)) as executor:
+            try:
+                while pending or in_flight:
+                    while pending and len(in_flight) < n_workers:
+                        # charged before submit: a pool that breaks on submit fails this design below
+                        submitting = pending.pop(0)
+                        attempts[submitting] += 1
+                        submitted_at[submitting] = time.perf_counter()
+                        future = executor.submit(run_job, submitting, output_root, incremental, stage_workers, def_workers, writer is not None)
+                        in_flight[future] = submitting
+                        submitting = None
+                    done, _ = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        summary = future.result()
+                        folder_path = in_flight.pop(future)
+                        summary['attempts'] = attempts[folder_path]
+                        busy_of[folder_path] += summary['wall_seconds']
+                        if 'pack' in summary:
+                            writer.append(summary['design'], *summary.pop('pack'))
+                        results[folder_path] = summary
+                        if summary['status'] != 'ok' and attempts[folder_path] <= retries:
+                            pending.append(folder_path)
+                            progress = 'retry'
+                        else:
+                            finished += 1
+                            progress = f'{finished}/{len(jobs)}'
+                        print(f"[{progress}] {summary['design']}: {summary['status']} "
+                              f"in {summary['wall_seconds']:.1f}s (attempt {attempts[folder_path]})")
+            except concurrent.futures.process.BrokenProcessPool as e:
+                broken = list(in_flight.values()) + ([submitting] if submitting else [])
+                for folder_path in broken:
+                    busy_of[folder_path] += time.perf_counter() - submitted_at[folder_path]
+                    results[folder_path] = {'design': os.path.basename(folder_path), 'status': 'failed',
+                                            'error': f'worker died: {e}', 'attempts': attempts[folder_path]}
+                    if attempts[folder_path] <= retries:
+                        progress = 'retry'
+                    else:
+                        finished += 1
+                        progress = f'{finished}/{len(jobs)}'
+                    print(f"[{progress}] {os.path.basename(folder_path)}: worker died (attempt {attempts[folder_path]})")
+                # designs not started yet stay pending for the rebuilt pool; any that never run are
+                # reported as failed, so none can drop out of the summary
+                for folder_path in pending:
+                    not_started[folder_path] = {'design': os.path.basename(folder_path), 'status': 'failed',
+                                                'error': f'not started, worker pool broke: {e}',
+                                                'attempts': attempts[folder_path]}
+                pending.extend(folder_path for folder_path in broken if attempts[folder_path] <= retries)
+    for folder_path, summary in not_started.items():
+        results.setdefault(folder_path, summary)
+    if writer is not None:
+        writer.close()
+    wall = time.perf_counter() - start
+
+    failed = sorted(summary['design'] for summary in results.values() if summary['status'] != 'ok')
+    for summary in results.values():
+        if summary['status'] == 'ok':
+            quarantine.pop(summary['design'], None)
+        else:
+            quarantine[summary['design']] = summary['error']
+    if quarantine_path:
+        write_json(quarantine_path, quarantine)
+
+    busy = sum(busy_of.values())
+    run_summary = {
+        'n_workers': n_workers,
+        'stage_workers': stage_workers,
+        'wall_seconds': wall,
+        'busy_seconds': busy,
+        'utilization': busy / (wall * n_workers) if wall > 0 else 0,
+        'ok': sorted(summary['design'] for summary in results.values() if summary['status'] == 'ok'),
+        'failed': failed,
+        'skipped_quarantined': sorted(skipped),
+        'packed': len(writer.index['designs']) if writer is not None else 0,
+        'designs': {summary['design']: dict(summary, input_bytes=size_of[folder_path], busy_seconds=busy_of[folder_path])
+                    for folder_path, summary in results.items()},
+    }
+    if summary_path:
+        write_json(summary_path, run_summary)
+    print(f"{len(run_summary['ok'])} designs ok, {len(failed)} failed, {len(skipped)} quarantined and skipped "
+          f"in {wall:.1f}s ({run_summary['utilization']:.0%} worker utilization)")
+    return run_summary
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Extract the feature maps of many designs')
+    parser.add_argument('--data_root', default='/mnt/research/Hu_Jiang/Students/Poudel_Bidhan/data1/home/grads/b/bidhanpoudel/Design-files/Data', help='parent dir of the design folders')
+    parser.add_argument('--output_root', default=feature_extraction.output_root, help='output dir, one subfolder per design')
+    parser.add_argument('--n_workers', type=int, default=None, help='number of design workers (default: all cores)')
+    parser.add_argument('--stage_workers', type=int, default=1, help='processes running the map stages of one design (sharing a design store)')
+    parser.add_argument('--def_workers', type=int, default=1, help='processes parsing one DEF')
+    parser.add_argument('--memory_limit_gb', type=float, default=None, help='address space cap per worker')
+    parser.add_argument('--retries', type=int, default=1, help='retries of a failing design before it is quarantined')
+    parser.add_argument('--full', action='store_true', help='regenerate every map, ignoring the manifests')
+    parser.add_argument('--retry_quarantined', action='store_true', help='also run the quarantined designs')
+    parser.add_argument('--pack_path', default=None, help='also stream each finished design into a packed dataset (Training/packed_dataset.py); the per-map .npy files stay for incremental runs')
+    parser.add_argument('--summary', default=None, help='run summary JSON (default: <output_root>/run_summary.json)')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    os.makedirs(args.output_root, exist_ok=True)
+    run_summary = schedule(
+        sorted(glob.glob(os.path.join(args.data_root, '*'))), args.output_root,
+        n_workers=args.n_workers, stage_workers=args.stage_workers, def_workers=args.def_workers,
+        memory_limit=int(args.memory_limit_gb * (1 << 30)) if args.memory_limit_gb else None,
+        retries=args.retries, incremental=not args.full,
+        quarantine_path=os.path.join(args.output_root, 'quarantine.json'),
+        summary_path=args.summary or os.path.join(args.output_root, 'run_summary.json'),
+        retry_quarantined=args.retry_quarantined, pack_path=args.pack_path)
+    if args.pack_path:
+        print(f"Packed {run_summary['packed']} designs into {args.pack_path}")
+    sys.exit(1 if run_summary['failed'] else 0)